@@ -3,432 +3,572 @@
 ### Released under the MIT License https://opensource.org/licenses/MIT
 ###
 
-import sqlite3
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+import argparse
 import glob
-import os
+import heapq
 import json
+import os
 import pathlib
 import signal
 import sys
 
+import cyt_clock
+import cyt_metrics
+import ignore_store
+import kismet_db
+from cyt_events import EventLog
+from cyt_gps import GpsdReader
+from cyt_learning import LearningPhase, parse_geofence
+from cyt_workers import DecodePool
+from kismet_stream import KismetStreamReader
+from log_watcher import KismetLogWatcher
+from mac_address import int_to_mac, parse_mac
+from mac_linker import MacLinker, fingerprint, identity_mac
+from pcap_source import CAPTURE_SUFFIXES, PcapReader
+from persistence_tracker import PersistenceTracker, config_windows
+
 with open('config.json', 'r') as f:
     config = json.load(f)
 
+parser = argparse.ArgumentParser(description='Chasing Your Tail - detect devices that persist across time windows')
+parser.add_argument('--offline', nargs='+', metavar='PATH',
+                    help='Analyze finished .kismet files or pcap/pcapng captures (or directories of them) at full speed and exit')
+parser.add_argument('--api', action='store_true',
+                    help='Stream device changes from the Kismet REST API (kismet_api in config.json) instead of the log file')
+parser.add_argument('--pcap', metavar='PATTERN',
+                    help='Read probe requests from the newest pcap/pcapng capture matching PATTERN (e.g. from tcpdump -w) instead of Kismet')
+parser.add_argument('--learn', type=float, metavar='MINUTES',
+                    help='Add every device seen to the ignore list for MINUTES before alerting')
+parser.add_argument('--learn-geofence', type=parse_geofence, metavar='LAT,LON,RADIUS_M',
+                    help='Add every device seen to the ignore list until GPS puts the sensor outside this circle')
+parser.add_argument('--debug', action='store_true', help='Log debug information')
+args = parser.parse_args()
+
 ### Check for/make subdirectories for logs, ignore lists etc.
 cyt_sub = pathlib.Path(config['paths']['log_dir'])
 cyt_sub.mkdir(parents=True, exist_ok=True)
 
-print ('Current Time: ' + time.strftime('%Y-%m-%d %H:%M:%S'))
+### Clock for all timing (a simulated clock lets replays run hours in seconds)
+clock = cyt_clock.get_clock()
+check_interval = config.get('timing', {}).get('check_interval', 60)
 
-### Create Log file
+### Per-cycle timers and counters, exported as Prometheus text
+metrics = cyt_metrics.from_config(config)
+metrics_file = config.get('metrics', {}).get('textfile')
+if metrics_file:
+    metrics_file = cyt_sub / metrics_file
 
-log_file_name = f'./logs/cyt_log_{time.strftime("%m%d%y_%H%M%S")}'
+### Create Log file (JSONL events, written in batches and rotated by size/age)
 
-cyt_log = open(log_file_name,"w", buffering=1) 
+cyt_log = EventLog.from_config(config, echo=True, clock=clock)
 
+cyt_log.status('Current Time: ' + time.strftime('%Y-%m-%d %H:%M:%S'))
 
-#######Import ignore list and alert if not found
 
-non_alert_ssid_list = []
-ssid_list_path = pathlib.Path('./ignore_lists') / config['paths']['ignore_lists']['ssid']
-if ssid_list_path.exists():
-    with open(ssid_list_path, 'r') as f:
-        exec(f.read())  # This will execute the line that sets non_alert_ssid_list
+#######Import ignore lists (binary store, converted from the old .py lists on first run)
 
-if non_alert_ssid_list:
-	pass
-else:
-    print ("No Probed SSID Ignore List Found!")
-    cyt_log.write("No Probed SSID Ignore List Found! \n")
-    
-probe_ignore_list = non_alert_ssid_list
+### MACs are matched as 48-bit integers against the exact list and the OUI/prefix rules
+ignore_lists = ignore_store.open_from_config(config)
+probe_ignore_list = ignore_store.SsidFilter(ignore_lists.ssids if ignore_lists is not None else frozenset())
+ignore_list = ignore_store.mac_filter_from_config(config, ignore_lists)
 
-ignore_list = []
-ignore_list_path = pathlib.Path('./ignore_lists') / config['paths']['ignore_lists']['mac']
-if ignore_list_path.exists():
-    with open(ignore_list_path, 'r') as f:
-        exec(f.read())  # This will execute the line that sets ignore_list
+if not probe_ignore_list:
+    cyt_log.status("No Probed SSID Ignore List Found!")
+if not ignore_list:
+    cyt_log.status("No Ignore List Found!")
 
-if ignore_list:
-	pass
-else:
-    print ("No Ignore List Found!")
-    cyt_log.write("No Ignore List Found! \n")
-    
-    
-print ('{} MACs added to ignore list.'.format(len(ignore_list)))
-print ('{} Probed SSIDs added to ignore list.'.format(len(probe_ignore_list)))
-cyt_log.write ('{} MACs added to ignore list. \n'.format(len(ignore_list)))
-cyt_log.write ('{} Probed SSIDs added to ignore list. \n'.format(len(probe_ignore_list)))
+cyt_log.status('{} MACs added to ignore list.'.format(len(ignore_list.exact)))
+if ignore_list.rules:
+    cyt_log.status('{} MAC ignore rules loaded.'.format(len(ignore_list.rules)))
+cyt_log.status('{} Probed SSIDs added to ignore list.'.format(len(probe_ignore_list)))
+
+### The GUI, create_ignore_list.py and learning mode rewrite the same store; a
+### rewrite is swapped in between cycles without touching the time windows
+ignore_watcher = ignore_store.StoreWatcher(ignore_store.store_path_from_config(config))
 
 ### Set Initial Variables
 db_path = config['paths']['kismet_logs']
-
-###Initialize Lists
-current_macs = []
-five_ten_min_ago_macs = []
-ten_fifteen_min_ago_macs = []
-fifteen_twenty_min_ago_macs = []
-current_ssids = []
-five_ten_min_ago_ssids = []
-ten_fifteen_min_ago_ssids = []
-fifteen_twenty_min_ago_ssids = []
-
-past_five_mins_macs = []
-past_five_mins_ssids = []
-
-### Calculate Time Variables
-two_mins_ago = datetime.now() + timedelta(minutes=-2)  
-unixtime_2_ago = time.mktime(two_mins_ago.timetuple())  ### Two Minute time used for current results
-five_mins_ago = datetime.now() + timedelta(minutes=-5)
-unixtime_5_ago = time.mktime(five_mins_ago.timetuple())
-ten_mins_ago = datetime.now() + timedelta(minutes=-10)
-unixtime_10_ago = time.mktime(ten_mins_ago.timetuple())
-fifteen_mins_ago = datetime.now() + timedelta(minutes=-15)
-unixtime_15_ago = time.mktime(fifteen_mins_ago.timetuple())
-twenty_mins_ago = datetime.now() + timedelta(minutes=-20)
-unixtime_20_ago = time.mktime(twenty_mins_ago.timetuple())
-
-######Find Newest DB file
-list_of_files = glob.glob(db_path)
-latest_file = max(list_of_files, key=os.path.getctime)
-print ("Pulling data from: {}".format(latest_file))
-cyt_log.write ("Pulling data from: {} \n".format(latest_file))
-con = sqlite3.connect(latest_file) ## kismet DB to point at
-
-######Initialize macs past five minutes
-
-def sql_fetch_past_5(con): 
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac FROM devices WHERE last_time >= {}".format(unixtime_5_ago)) 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        #print(row)
-        stripped_val = str(row).replace("(","").replace(")","").replace("'","").replace(",","")
-        
-        if stripped_val in ignore_list:
-            pass
-        else:
-            #print ("new one!")
-            past_five_mins_macs.append(stripped_val)
-
-sql_fetch_past_5(con)
-
-print ("{} MACS added to the within the past 5 mins list".format(len(past_five_mins_macs)))
-cyt_log.write ("{} MACS added to the within the past 5 mins list \n".format(len(past_five_mins_macs)))
-######Initialize macs five to ten minutes ago
-
-def sql_fetch_5_to_10(con): 
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac FROM devices WHERE last_time <= {} AND last_time >= {} ".format(unixtime_5_ago, unixtime_10_ago)) 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        #print(row)
-        stripped_val = str(row).replace("(","").replace(")","").replace("'","").replace(",","")
-        
-        if stripped_val in ignore_list:
-            pass
-        else:
-            #print ("new one!")
-            five_ten_min_ago_macs.append(stripped_val)
-
-sql_fetch_5_to_10(con)
-
-print ("{} MACS added to the 5 to 10 mins ago list".format(len(five_ten_min_ago_macs)))
-cyt_log.write ("{} MACS added to the 5 to 10 mins ago list \n".format(len(five_ten_min_ago_macs)))
-
-######Initialize macs ten to fifteen minutes ago
-
-def sql_fetch_10_to_15(con):
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac FROM devices WHERE last_time <= {} AND last_time >= {} ".format(unixtime_10_ago, unixtime_15_ago)) 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        #print(row)
-        stripped_val = str(row).replace("(","").replace(")","").replace("'","").replace(",","")
-		        
-        if stripped_val in ignore_list:
-            pass
-        else:
-            #print ("new one!")
-            ten_fifteen_min_ago_macs.append(stripped_val)
-        
-
-sql_fetch_10_to_15(con)
-
-print ("{} MACS added to the 10 to 15 mins ago list".format(len(ten_fifteen_min_ago_macs)))
-cyt_log.write ("{} MACS added to the 10 to 15 mins ago list \n".format(len(ten_fifteen_min_ago_macs)))
-
-######Initialize macs fifteen to twenty minutes ago
-
-def sql_fetch_15_to_20(con):
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac FROM devices WHERE last_time <= {} AND last_time >= {} ".format(unixtime_15_ago, unixtime_20_ago)) 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        #print(row)
-        stripped_val = str(row).replace("(","").replace(")","").replace("'","").replace(",","")
-		
-        if stripped_val in ignore_list:
-            pass
+DEBUG = args.debug
+
+def format_alert(tracker, k, mac, dev_type, probed_ssid):
+    """Alert level and message for a device (MAC as text) seen again from window k"""
+    level = tracker.level(k)
+    if level == 'CRITICAL':
+        alert = f"CRITICAL: Device {mac} ({dev_type}) potentially following - seen across {tracker.window_label(k)} min window"
+    else:
+        alert = f"{level}: Device {mac} ({dev_type}) seen again after {tracker.window_label(k)} mins"
+    if probed_ssid:
+        alert += f" - Probing for: {probed_ssid}"
+    return level, alert
+
+######Optional worker processes for decoding big fetches (workers section of config.json)
+
+decode_pool = DecodePool.from_config(config)
+
+######Link randomized MACs that look like the same device (probe fingerprint MinHash/LSH)
+###Linked identities get their own tracker, so persistence is checked per identity as
+###well as per MAC without changing the per-MAC windows
+
+linker = MacLinker.from_config(config)
+
+def fingerprint_features(rows):
+    """Fingerprint features per randomized MAC from kismet_db.fetch_fingerprints() rows"""
+    features = {}
+    for devmac, ssids, ie in rows:
+        mac = parse_mac(devmac)
+        if mac is not None:
+            features.setdefault(mac, set()).update(
+                fingerprint([ssid for ssid in ssids if ssid not in probe_ignore_list], ie))
+    return features
+
+def fingerprints_since(con, start_time):
+    """Fingerprint features of the randomized MACs last seen since start_time"""
+    if linker is None:
+        return {}
+    return fingerprint_features(decode_pool.fetch_fingerprints(con, start_time))
+
+def link_identity(identities, mac, row_time, probed_ssid, features):
+    """Identity key of a randomized MAC after linking it, or None"""
+    if linker is None:
+        return None
+    found = features.get(mac, set())
+    if probed_ssid:
+        found = found | fingerprint([probed_ssid])
+    label, merges = linker.update(mac, found, row_time)
+    for old, new in merges:
+        identities.relabel(old, new)
+    return label
+
+def identity_windows(identities, label, windows, now):
+    """Windows (measured back from now) a linked identity was seen in that its current MAC was not"""
+    if label is None or len(linker.members(label)) < 2:
+        return []
+    return [k for k in identities.windows_seen(label, now) if k not in windows]
+
+def identity_alert(identities, k, label, mac, dev_type, probed_ssid, ts=None, when=None):
+    level, alert = format_alert(identities, k, linker.describe(label), dev_type, probed_ssid)
+    if when:
+        alert = f"[{when}] {alert}"
+    cyt_log.alert(level, mac, dev_type, identities.window_label(k), alert, probed_ssid, ts=ts,
+                  identity=int_to_mac(identity_mac(label)),
+                  linked_macs=sorted(int_to_mac(m) for m in linker.members(label)))
+
+######Offline forensic mode: replay finished Kismet logs and exit
+
+def run_offline(paths):
+    """Replay the whole timeline of finished Kismet logs through a tracker
+
+    Sightings are read per file in one grouped query and merged by time, and
+    the tracker clock follows the sightings instead of the wall clock, so alerts
+    carry their original timestamps and an 8 hour session takes seconds.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(name for name in glob.glob(os.path.join(path, '*'))
+                                if name.endswith(('.kismet',) + CAPTURE_SUFFIXES)))
         else:
-            #print ("new one!")
-            fifteen_twenty_min_ago_macs.append(stripped_val)
+            files.append(path)
+    streams = []
+    features = {}
+    for path in files:
+        cyt_log.status("Replaying {}: {}".format('capture' if path.endswith(CAPTURE_SUFFIXES) else 'Kismet log', path))
+    for sightings, fingerprints in decode_pool.read_logs(files):
+        streams.append(sightings)
+        if linker:
+            for mac, found in fingerprint_features(fingerprints).items():
+                features.setdefault(mac, set()).update(found)
+    
+    started = time.time()
+    tracker = None
+    sightings = 0
+    alerts = 0
+    identity_alerted = {}  # identity key -> timestamp of its last alert
+    handled_time = None    # Sightings are merged in time order, so only the MACs
+    handled_macs = set()   # handled at the current timestamp are kept
+    # Merge on the timestamp alone: a device in two sources (a Kismet log and its
+    # capture) ties on (slot, devmac), and type/SSID can be None in one and text in the other
+    for timestamp, devmac, dev_type, probed_ssid in heapq.merge(*streams, key=lambda sighting: sighting[0]):
+        if tracker is None:
+            tracker = PersistenceTracker.from_config(config, timestamp)
+            identities = PersistenceTracker.from_config(config, timestamp)
+        identities.advance(timestamp)
+        if tracker.advance(timestamp) and linker:
+            linker.expire(timestamp - tracker.max_window_seconds)
+        mac = parse_mac(devmac)
+        if mac is None or mac in ignore_list:
+            continue
+        if probed_ssid in probe_ignore_list:
+            probed_ssid = None
+        # The same device from a second source (e.g. the Kismet log and its capture)
+        # only adds the SSID it may carry where the other had none
+        if timestamp != handled_time:
+            handled_time = timestamp
+            handled_macs = set()
+        if mac in handled_macs:
+            tracker.observe(None, timestamp, probed_ssid)
+            continue
+        handled_macs.add(mac)
+        sightings += 1
         
-
-sql_fetch_15_to_20(con)
-
-print ("{} MACS added to the 15 to 20 mins ago list".format(len(fifteen_twenty_min_ago_macs)))
-cyt_log.write("{} MACS added to the 15 to 20 mins ago list \n".format(len(fifteen_twenty_min_ago_macs)))
-
-######Initialize probe requests past 5 minutes
-
-def probe_request_sql_fetch(con, start_time, end_time=None, target_list=None):
-    """Generic probe request fetcher
-    Args:
-        con: Database connection
-        start_time: Start time in unix timestamp
-        end_time: Optional end time in unix timestamp
-        target_list: List to append results to
-    """
-    query = "SELECT devmac, type, device FROM devices WHERE last_time >= ?"
-    params = [start_time]
-    if end_time:
-        query += " AND last_time <= ?"
-        params.append(end_time)
+        when = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        windows = tracker.windows_seen(mac, timestamp)
+        for k in windows:
+            level, alert = format_alert(tracker, k, devmac, dev_type, probed_ssid)
+            cyt_log.alert(level, devmac, dev_type, tracker.window_label(k), f"[{when}] {alert}", probed_ssid, ts=timestamp)
+            alerts += 1
+        tracker.observe(mac, timestamp, probed_ssid)
         
-    cursorObj = con.cursor()
-    cursorObj.execute(query, params)
-    rows = cursorObj.fetchall()
+        label = link_identity(identities, mac, timestamp, probed_ssid, features)
+        if label is not None:
+            if identity_alerted.get(label) != timestamp:
+                for k in identity_windows(identities, label, windows, timestamp):
+                    identity_alert(identities, k, label, devmac, dev_type, probed_ssid, ts=timestamp, when=when)
+                    identity_alerted[label] = timestamp
+                    alerts += 1
+            identities.observe(label, timestamp)
     
-    for row in rows:
-        raw_device_json = json.loads(str(row[2], errors='ignore'))
-        if 'dot11.probedssid.ssid' in str(row):
-            ssid = raw_device_json["dot11.device"]["dot11.device.last_probed_ssid_record"]["dot11.probedssid.ssid"]
-            if ssid and ssid not in probe_ignore_list:
-                target_list.append(ssid)
-
-probe_request_sql_fetch(con, unixtime_5_ago, unixtime_10_ago, past_five_mins_ssids)
-
-print ("{} Probed SSIDs added to the within the past 5 minutes list".format(len(past_five_mins_ssids)))
-cyt_log.write ("{} Probed SSIDs added to the within the past 5 minutes list \n".format(len(past_five_mins_ssids)))
-
-######Initialize probe requests five to ten minutes ago
+    cyt_log.status("Replayed {} sightings from {} file(s) in {:.1f}s, {} alerts".format(
+        sightings, len(files), time.time() - started, alerts))
+    cyt_log.stats(mode='offline', files=len(files), sightings=sightings, alerts=alerts)
 
-probe_request_sql_fetch(con, unixtime_5_ago, unixtime_10_ago, five_ten_min_ago_ssids)
-
-print ("{} Probed SSIDs added to the 5 to 10 mins ago list".format(len(five_ten_min_ago_ssids)))
-cyt_log.write("{} Probed SSIDs added to the 5 to 10 mins ago list \n".format(len(five_ten_min_ago_ssids)))
-
-######Initialize probe requests ten to fifteen minutes ago
-
-probe_request_sql_fetch(con, unixtime_10_ago, unixtime_15_ago, ten_fifteen_min_ago_ssids)
-
-print ("{} Probed SSIDs added to the 10 to 15 mins ago list".format(len(ten_fifteen_min_ago_ssids)))
-cyt_log.write ("{} Probed SSIDs added to the 10 to 15 mins ago list \n".format(len(ten_fifteen_min_ago_ssids)))
-
-######Initialize probe requests fifteem to twenty minutes ago
-
-probe_request_sql_fetch(con, unixtime_15_ago, unixtime_20_ago, fifteen_twenty_min_ago_ssids)
-
-print ("{} Probed SSIDs added to the 15 to 20 mins ago list".format(len(fifteen_twenty_min_ago_ssids)))
-cyt_log.write("{} Probed SSIDs added to the 15 to 20 mins ago list \n".format(len(fifteen_twenty_min_ago_ssids)))
-
-#### Define main logic
+if args.offline:
+    run_offline(args.offline)
+    decode_pool.close()
+    cyt_log.close()
+    sys.exit(0)
 
-def sql_fetch_current(con):
-    two_mins_ago = datetime.now() + timedelta(minutes=-2)  
-    unixtime_2_ago = time.mktime(two_mins_ago.timetuple())
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac, type, device FROM devices WHERE last_time >= {}".format(unixtime_2_ago)) 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        raw_device_json = json.loads(str(row[2], errors='ignore'))
-        stripped_val = str(row[0])  # Get MAC directly
+######Learning mode: add everything seen to the ignore lists for a while (or while
+###inside a geofence), then start alerting without restarting or re-reading anything
+
+gps = None
+if args.learn_geofence or config.get('learning', {}).get('geofence'):
+    gps = GpsdReader.from_config(config, clock)
+    if gps is None:
+        cyt_log.status("GPS is off in config.json, learning by geofence is off")
+    else:
+        cyt_log.status("Reading position from gpsd at {}:{}".format(gps.host, gps.port))
+learning = LearningPhase.from_config(config, ignore_list, probe_ignore_list, ignore_store.store_path_from_config(config),
+                                     gps=gps, clock=clock, minutes=args.learn, geofence=args.learn_geofence)
+if learning:
+    cyt_log.status("Learning the baseline {}: every device seen is added to the ignore list".format(learning.describe()))
+
+###Initialize Tracker (windows come from timing.time_windows in config.json),
+###resuming from the last checkpoint when there is a usable one
+checkpoint_path = cyt_sub / config['paths'].get('checkpoint', 'tracker_state.ckpt')
+checkpoint_interval = config.get('timing', {}).get('checkpoint_interval', 60)
+resumed = PersistenceTracker.load(checkpoint_path, config_windows(config))
+if resumed:
+    tracker, watermark_time, watermark_macs = resumed
+    tracker.advance(clock.time())
+    cyt_log.status("Resumed tracker state from {}".format(checkpoint_path))
+else:
+    tracker = PersistenceTracker.from_config(config, clock.time())
+identities = PersistenceTracker.from_config(config, clock.time())
+
+######Find Newest DB file and watch for new ones, or stream from the Kismet API
+use_api = args.api or config.get('kismet_api', {}).get('enabled', False)
+max_sessions = config.get('database', {}).get('max_sessions', kismet_db.DEFAULT_MAX_SESSIONS)
+### Window queries run against CYT's own indexed copy of the Kismet devices tables
+mirror_path = config.get('database', {}).get('mirror')
+if mirror_path:
+    mirror_path = cyt_sub / mirror_path
+
+def open_reader(latest_file):
+    """Open the newest Kismet database read-only, with earlier sessions that overlap
+    the longest time window attached so a Kismet restart does not lose history
+    (or follow the newest capture with --pcap)"""
+    if args.pcap:
+        return PcapReader(latest_file, retain_seconds=tracker.max_window_seconds, clock=clock)
+    history = log_watcher.sessions(clock.time() - tracker.max_window_seconds, max_sessions - 1)
+    for path in history:
+        cyt_log.status("Including earlier Kismet session: {}".format(path))
+    return kismet_db.KismetReader.from_config(latest_file, config, history=history, mirror=mirror_path,
+                                              retain_seconds=tracker.max_window_seconds, clock=clock, pool=decode_pool)
+
+if use_api:
+    ### Changes arrive within seconds, so cycle at the API poll interval
+    log_watcher = None
+    since = clock.time() - tracker.max_window_seconds
+    if resumed:
+        since = max(since, watermark_time - 1)
+    reader = KismetStreamReader.from_config(config, since=since, retain_seconds=tracker.max_window_seconds, clock=clock)
+    cyt_log.status("Streaming device changes from Kismet at {}".format(reader.url))
+    if not reader.wait_ready():
+        cyt_log.status("Kismet API not answering yet ({}), will keep retrying".format(reader.last_error))
+    check_interval = reader.poll_interval
+else:
+    log_watcher = KismetLogWatcher(args.pcap or db_path)
+    latest_file = log_watcher.current
+    cyt_log.status("Pulling data from: {}".format(latest_file))
+    reader = open_reader(latest_file) ## kismet DB to point at, read-only
+con = reader.refresh()
+
+######Initialize every tracked window from a single pass over the longest one
+
+def bootstrap_tracker(con, start_time):
+    """Bucket every MAC and probed SSID seen since start_time into the tracker
+    Returns:
+        High-water mark (last_time, devmacs seen at that last_time) of the rows read
+    """
+    high_time = start_time
+    high_macs = set()
+    features = fingerprints_since(con, start_time)
+    for devmac, dev_type, last_time, ssid in decode_pool.fetch_devices(con, start_time):
+        mac = parse_mac(devmac)
+        if mac is None:
+            continue
+        if last_time > high_time:
+            high_time = last_time
+            high_macs = set()
+        if last_time == high_time:
+            high_macs.add(mac)
         
-        if stripped_val in ignore_list:
+        if ssid in probe_ignore_list:
+            ssid = None
+        if learning:
+            learning.learn(mac, ssid)
             continue
-            
-        # Track device movement through time windows
-        if stripped_val in five_ten_min_ago_macs:
-            print("ALERT: {} {} seen again after 5-10 mins".format(stripped_val, row[1]))
-            cyt_log.write("ALERT: {} {} seen again after 5-10 mins\n".format(stripped_val, row[1]))
-        if stripped_val in ten_fifteen_min_ago_macs:
-            print("WARNING: {} {} seen again after 10-15 mins".format(stripped_val, row[1]))
-            cyt_log.write("WARNING: {} {} seen again after 10-15 mins\n".format(stripped_val, row[1]))
-        if stripped_val in fifteen_twenty_min_ago_macs:
-            print("CRITICAL: {} {} potentially following - seen across 15-20 min window".format(stripped_val, row[1]))
-            cyt_log.write("CRITICAL: {} {} potentially following - seen across 15-20 min window\n".format(stripped_val, row[1]))
-
-## End sql_fetch_current
-
+        if mac not in ignore_list:
+            tracker.observe(mac, last_time)
+            label = link_identity(identities, mac, last_time, ssid, features)
+            if label is not None:
+                identities.observe(label, last_time)
+        if ssid:
+            tracker.observe(None, last_time, ssid)
+    return high_time, high_macs
+
+### A recent checkpoint only needs the delta since its watermark, which the
+### first cycle of the main loop picks up
+if resumed and watermark_time >= clock.time() - tracker.max_window_seconds:
+    cyt_log.status("Catching up from checkpoint watermark {}".format(datetime.fromtimestamp(watermark_time)))
+else:
+    watermark_time, watermark_macs = bootstrap_tracker(con, clock.time() - tracker.max_window_seconds)
 
+for label, mac_count, ssid_count in tracker.window_sizes():
+    cyt_log.status("{} MACS and {} Probed SSIDs added to the {} mins ago list".format(mac_count, ssid_count, label))
 
 #### Begin Time Loop
 
 time_count = 0
 
-DEBUG = False  # Set via command line arg or config
-
 def debug_print(*args, **kwargs):
     if DEBUG:
-        print("[DEBUG]", *args, **kwargs)
-        cyt_log.write(f"[DEBUG] {' '.join(map(str, args))}\n")
+        cyt_log.emit('debug', f"[DEBUG] {' '.join(map(str, args))}")
+
+def save_checkpoint():
+    """Write the tracker state and poll watermark so a restart can resume"""
+    global last_checkpoint
+    try:
+        tracker.save(checkpoint_path, watermark_time, watermark_macs)
+    except OSError as e:
+        cyt_log.status(f"Error saving checkpoint: {e}")
+    last_checkpoint = clock.time()
+
+last_checkpoint = clock.time()
 
 def signal_handler(signum, frame):
-    print("\nShutting down gracefully...")
-    cyt_log.write("Shutting down gracefully...\n")
+    cyt_log.status("Shutting down gracefully...")
+    save_checkpoint()
+    if learning:
+        learning.flush()
+    if gps:
+        gps.close()
     cyt_log.close()
+    reader.close()
+    if log_watcher:
+        log_watcher.close()
+    decode_pool.close()
     sys.exit(0)
 
 signal.signal(signal.SIGINT, signal_handler)
-
-def monitor_probe_requests(con, device_json):
-    """Monitor and process new probe requests"""
-    try:
-        if 'dot11.device' in device_json:
-            dot11_data = device_json['dot11.device']
-            if 'dot11.device.last_probed_ssid_record' in dot11_data:
-                probe_data = dot11_data['dot11.device.last_probed_ssid_record']
-                if 'dot11.probedssid.ssid' in probe_data:
-                    ssid = probe_data['dot11.probedssid.ssid']
-                    if ssid and ssid not in probe_ignore_list:
-                        print(f"Found a probe!: {ssid}")
-                        cyt_log.write(f"Found a probe!: {ssid}\n")
-                        return ssid
-    except Exception as e:
-        debug_print(f"Error processing probe request: {e}")
-    return None
+signal.signal(signal.SIGTERM, signal_handler)  # systemctl stop, reboot
+
+### High-water mark for incremental polling (starts where the bootstrap pass ended).
+### Kismet stores last_time in whole seconds, so the tiebreaker is the set of
+### devmacs already handled at that second.
+
+def reload_ignore_lists(store):
+    """Swap in a rewritten ignore store and drop newly ignored MACs and SSIDs from the windows"""
+    global ignore_lists
+    ignore_list.exact = store.macs
+    probe_ignore_list.known = store.ssids
+    if ignore_lists is not None:
+        ignore_lists.close()
+    ignore_lists = store
+    macs, ssids = tracker.forget(lambda mac: mac in ignore_list, lambda ssid: ssid in probe_ignore_list)
+    metrics.inc('ignore_reloads')
+    cyt_log.status("Reloaded ignore list: {} MACs, {} Probed SSIDs ({} MACs and {} Probed SSIDs dropped "
+                   "from the time windows)".format(len(store.macs), len(store.ssids), macs, ssids))
 
 def check_new_devices(con):
-    """Check for new devices and probe requests"""
-    two_mins_ago = datetime.now() + timedelta(minutes=-2)  
-    unixtime_2_ago = time.mktime(two_mins_ago.timetuple())
+    """Check devices changed since the previous cycle for persistence and probe requests"""
+    global watermark_time, watermark_macs
     
-    cursorObj = con.cursor()
-    cursorObj.execute("""
-        SELECT devmac, type, device, last_time 
-        FROM devices 
-        WHERE last_time >= ?
-        ORDER BY last_time DESC
-    """, (unixtime_2_ago,))
+    # Rows are streamed a page at a time through the ignore filter, so only the
+    # (much smaller) list of fresh sightings is ever held; sql_fetch is the time
+    # spent fetching them and ignore_filter the rest
+    decoded_before = kismet_db.decoded_bytes
+    filter_started = time.perf_counter()
+    rows = cyt_metrics.TimedIterator(decode_pool.fetch_devices, con, watermark_time)
     
-    rows = cursorObj.fetchall()
-    new_devices = []
-    
-    for row in rows:
-        mac = str(row[0])
-        dev_type = row[1]
-        device_json = json.loads(str(row[2], errors='ignore'))
-        last_time = datetime.fromtimestamp(row[3])
+    # Skip rows handled at the watermark second last cycle and ignored devices
+    since = watermark_time
+    fresh = []
+    next_time = watermark_time
+    next_macs = set(watermark_macs)
+    for devmac, dev_type, row_time, row_ssid in rows:
+        mac = parse_mac(devmac)
+        if mac is None:
+            continue
+        if row_time == watermark_time and mac in watermark_macs:
+            continue
+        # Rows are read by rowid, not time, so keep the newest second and the MACs at it
+        if row_time > next_time:
+            next_time = row_time
+            next_macs = set()
+        if row_time == next_time:
+            next_macs.add(mac)
         
         if mac in ignore_list:
             continue
-            
-        # Check for probe requests
-        probed_ssid = monitor_probe_requests(con, device_json)
-        
-        # Track device persistence
-        device_info = {
-            'mac': mac,
-            'type': dev_type,
-            'last_seen': last_time,
-            'probed_ssid': probed_ssid
-        }
-        new_devices.append(device_info)
-        
-        # Check time windows for persistence
-        if mac in five_ten_min_ago_macs:
-            alert = f"ALERT: Device {mac} ({dev_type}) seen again after 5-10 mins"
-            if probed_ssid:
-                alert += f" - Probing for: {probed_ssid}"
-            print(alert)
-            cyt_log.write(f"{alert}\n")
-            
-        if mac in ten_fifteen_min_ago_macs:
-            warning = f"WARNING: Device {mac} ({dev_type}) seen again after 10-15 mins"
-            if probed_ssid:
-                warning += f" - Probing for: {probed_ssid}"
-            print(warning)
-            cyt_log.write(f"{warning}\n")
-            
-        if mac in fifteen_twenty_min_ago_macs:
-            critical = f"CRITICAL: Device {mac} ({dev_type}) potentially following - seen across 15-20 min window"
+        if row_ssid in probe_ignore_list:
+            row_ssid = None
+        fresh.append((mac, dev_type, row_time, row_ssid or None))
+    watermark_time = next_time
+    watermark_macs = next_macs
+    metrics.observe('sql_fetch', rows.seconds)
+    metrics.observe('ignore_filter', time.perf_counter() - filter_started - rows.seconds)
+    metrics.inc('rows', rows.count)
+    metrics.inc('json_decode_bytes', kismet_db.decoded_bytes - decoded_before)
+    metrics.set('rows_per_cycle', rows.count)
+    
+    # While learning, everything new goes into the ignore lists instead
+    if learning:
+        for mac, dev_type, row_time, probed_ssid in fresh:
+            learning.learn(mac, probed_ssid)
+        metrics.set('learned_macs', learning.learned_macs)
+        metrics.set('learned_ssids', learning.learned_ssids)
+        fresh = []
+    
+    # Link randomized MACs into identities by their probe fingerprints
+    with metrics.time('mac_linking'):
+        features = fingerprints_since(con, since) if linker and fresh else {}
+        labels = [link_identity(identities, mac, row_time, probed_ssid, features)
+                  for mac, dev_type, row_time, probed_ssid in fresh]
+    
+    # Check time windows for persistence (per MAC and per linked identity), then
+    # record this cycle's sightings
+    with metrics.time('window_match'):
+        matches = []
+        alerted = set()
+        for (mac, dev_type, row_time, probed_ssid), label in zip(fresh, labels):
+            windows = tracker.windows_seen(mac, row_time)
+            linked = []
+            if label is not None and label not in alerted:
+                linked = identity_windows(identities, label, windows, row_time)
+                if linked:
+                    alerted.add(label)
+            matches.append((windows, linked))
+            tracker.observe(mac, row_time, probed_ssid)
+            if label is not None:
+                identities.observe(label, row_time)
+    
+    with metrics.time('alert_emit'):
+        new_devices = []
+        alerts = 0
+        for (mac, dev_type, row_time, probed_ssid), label, (windows, linked) in zip(fresh, labels, matches):
+            mac = int_to_mac(mac)
             if probed_ssid:
-                critical += f" - Probing for: {probed_ssid}"
-            print(critical)
-            cyt_log.write(f"{critical}\n")
+                cyt_log.probe(probed_ssid, mac)
+            new_devices.append({
+                'mac': mac,
+                'type': dev_type,
+                'last_seen': datetime.fromtimestamp(row_time),
+                'probed_ssid': probed_ssid
+            })
+            for k in windows:
+                level, alert = format_alert(tracker, k, mac, dev_type, probed_ssid)
+                cyt_log.alert(level, mac, dev_type, tracker.window_label(k), alert, probed_ssid)
+                alerts += 1
+            for k in linked:
+                identity_alert(identities, k, label, mac, dev_type, probed_ssid)
+                alerts += 1
+    metrics.inc('alerts', alerts)
+    metrics.set('devices_per_cycle', len(new_devices))
+    if linker:
+        metrics.set('linked_identities', linker.linked_count())
     
     return new_devices
 
-while True:
+while clock.running():
     time_count += 1
+    cycle_started = time.perf_counter()
     try:
+        # Rotate the time windows as the tracker crosses into a new bucket
+        identities.advance(clock.time())
+        if tracker.advance(clock.time()):
+            if linker:
+                linker.expire(clock.time() - tracker.max_window_seconds)
+            window_sizes = tracker.window_sizes()
+            print("Updated MAC tracking lists:")
+            for label, mac_count, ssid_count in reversed(window_sizes):
+                print(f"- {label} min ago: {mac_count} MACs, {ssid_count} Probed SSIDs")
+                metrics.set('window_macs', mac_count, window=label)
+                metrics.set('window_ssids', ssid_count, window=label)
+            cyt_log.rotation(window_sizes)
+            
+        # Only reconnect when Kismet has started a new log file
+        with metrics.time('db_reconnect'):
+            new_file = log_watcher.poll() if log_watcher else None
+            if new_file:
+                reader.close()
+                reader = open_reader(new_file)
+                cyt_log.status(f"Switched to new Kismet database: {new_file}")
+                metrics.inc('db_reconnects')
+            
+        # End the learning phase once its time is up, the sensor leaves the geofence
+        # or there has been no GPS fix to tell for too long
+        if learning and not learning.active():
+            cyt_log.status("Learning finished ({}): {} MACs and {} Probed SSIDs added to the ignore list, "
+                           "alerting from now on".format(learning.finished, learning.learned_macs, learning.learned_ssids))
+            if learning.last_error:
+                cyt_log.status("Could not save the learned baseline: {}".format(learning.last_error))
+            learning = None
+        elif learning:
+            warning = learning.fix_warning()
+            if warning:
+                cyt_log.status(warning)
+        metrics.set('learning', int(learning is not None))
+
+        # Pick up ignore list edits made while running
+        new_store = ignore_watcher.poll()
+        if new_store is not None:
+            reload_ignore_lists(new_store)
+
         # Check for new devices and probe requests
+        with metrics.time('db_refresh'):
+            con = reader.refresh()
+        if use_api:
+            metrics.set('api_connected', int(reader.connected))
+            metrics.set('api_reconnects', reader.reconnects)
+            metrics.set('api_queue_depth', reader.queued)
         new_devices = check_new_devices(con)
         current_macs = [d['mac'] for d in new_devices]
+        mac_entries, ssid_entries = tracker.entry_counts()
+        metrics.set('tracker_mac_entries', mac_entries)
+        metrics.set('tracker_ssid_entries', ssid_entries)
+        metrics.observe('cycle', time.perf_counter() - cycle_started)
+        metrics.inc('cycles')
+        cyt_log.stats(devices=len(new_devices), watermark=watermark_time,
+                      cycle_seconds=round(time.perf_counter() - cycle_started, 4))
+        if metrics_file:
+            metrics.write_textfile(metrics_file)
         
-        # Update time windows every 5 minutes
-        if time_count % 5 == 0:
-            ##Update Lists
-            fifteen_twenty_min_ago_macs = ten_fifteen_min_ago_macs
-            ten_fifteen_min_ago_macs = five_ten_min_ago_macs
-            
-            print("Updated MAC tracking lists:")
-            print(f"- 15-20 min ago: {len(fifteen_twenty_min_ago_macs)}")
-            print(f"- 10-15 min ago: {len(ten_fifteen_min_ago_macs)}")
-            print(f"- 5-10 min ago: {len(five_ten_min_ago_macs)}")
-            print(f"- Current: {len(current_macs)}")
-            
-            # Still log everything to the file
-            cyt_log.write ("{} MACs moved to the 15-20 Min list \n".format(len(fifteen_twenty_min_ago_macs)))
-            cyt_log.write ("{} MACs moved to the 10-15 Min list \n".format(len(ten_fifteen_min_ago_macs)))
-            
-            fifteen_twenty_min_ago_ssids = ten_fifteen_min_ago_ssids
-            ten_fifteen_min_ago_ssids = five_ten_min_ago_ssids
-            
-            print ("{} Probed SSIDs moved to the 15 to 20 mins ago list".format(len(fifteen_twenty_min_ago_ssids)))
-            print ("{} Probed SSIDs moved to the 10 to 15 mins ago list".format(len(ten_fifteen_min_ago_ssids)))
-            
-            cyt_log.write ("{} Probed SSIDs moved to the 15 to 20 mins ago list \n".format(len(fifteen_twenty_min_ago_ssids)))
-            cyt_log.write ("{} Probed SSIDs moved to the 10 to 15 mins ago list \n".format(len(ten_fifteen_min_ago_ssids)))
-            
-            ###Update time variables
-            five_mins_ago = datetime.now() + timedelta(minutes=-5)
-            unixtime_5_ago = time.mktime(five_mins_ago.timetuple())
-            ten_mins_ago = datetime.now() + timedelta(minutes=-10)
-            unixtime_10_ago = time.mktime(ten_mins_ago.timetuple())
-            
-            ###Clear recent lists
-            five_ten_min_ago_macs = []
-            five_ten_min_ago_ssids = []
-            
-            ### Move the past 5 check from 5 mins ago into the past 5-10 list
-            #sql_fetch_5_to_10(con)
-            five_ten_min_ago_macs = past_five_mins_macs
-            print ("{} MACs moved to the 5 to 10 mins ago list".format(len(five_ten_min_ago_macs)))
-            cyt_log.write ("{} MACs moved to the 5 to 10 mins ago list \n".format(len(five_ten_min_ago_macs)))
-            five_ten_min_ago_ssids = past_five_mins_ssids
-            print ("{} Probed SSIDs moved to the 5 to 10 mins ago list".format(len(five_ten_min_ago_ssids)))
-            cyt_log.write ("{} Probed SSIDs moved to the 5 to 10 mins ago list \n".format(len(five_ten_min_ago_ssids)))
-            
-            ### Update past 5 min check to have them ready for 5 mins from now
-            past_five_mins_macs = []
-            past_five_mins_ssids = []
-            
-            sql_fetch_past_5(con)
-            probe_request_sql_fetch(con, unixtime_5_ago, unixtime_10_ago, past_five_mins_ssids)
-            #print ("{} MACs seen within the past 5 minutes".format(len(past_five_mins_macs)))
-            #past_five_mins_ssids
-            
-            # Refresh the database connection periodically
-            con.close()
-            latest_file = max(glob.glob(db_path), key=os.path.getctime)
-            con = sqlite3.connect(latest_file)
-            print(f"Refreshed database connection: {latest_file}")
-            cyt_log.write(f"Refreshed database connection: {latest_file}\n")
+        if clock.time() - last_checkpoint >= checkpoint_interval:
+            save_checkpoint()
             
         # Add debug information
         if DEBUG:
@@ -438,9 +578,22 @@ while True:
                     debug_print(f"Device {device['mac']} probing for {device['probed_ssid']}")
                     
     except Exception as e:
-        print(f"Error in main loop: {e}")
-        cyt_log.write(f"Error in main loop: {e}\n")
-        time.sleep(5)  # Wait before retrying
+        cyt_log.status(f"Error in main loop: {e}")
+        clock.sleep(5)  # Wait before retrying
         continue
         
-    time.sleep(60)  # Check every minute
+    # Write queued events now rather than after the sleep if they would be overdue by then
+    cyt_log.maybe_flush(within=check_interval)
+    clock.sleep(check_interval)  # Check every minute (every few seconds streaming from the API)
+
+### Only reached when a simulated clock runs out
+save_checkpoint()
+if learning:
+    learning.flush()
+if gps:
+    gps.close()
+reader.close()
+if log_watcher:
+    log_watcher.close()
+decode_pool.close()
+cyt_log.close()
@@ -1,70 +1,250 @@
-import sqlite3
+#!/usr/bin/env python3
+### Baseline (ignore list) builder for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+### Merges the devices and probed SSIDs of any number of Kismet sessions (log
+### files, or the sidecar mirror chasing_your_tail.py keeps) into the ignore
+### store. Sessions already ingested are recorded in a manifest next to the
+### store and skipped, so adding a week of logs to a months-old baseline only
+### reads the new week.
+
+import argparse
 import glob
 import json
 import os
 import pathlib
-
-# Load config
-with open('config.json', 'r') as f:
-    config = json.load(f)
-
-### Check for/make subdirectories for logs, ignore lists etc.
-cyt_sub = pathlib.Path('./ignore_lists')
-cyt_sub.mkdir(parents=True, exist_ok=True)
-
-non_alert_list = []
-non_alert_ssid_list = []
-
-### Get DB path from config
-db_path = config['paths']['kismet_logs']
-
-######Find Newest Kismet DB file
-list_of_files = glob.glob(db_path)
-latest_file = max(list_of_files, key=os.path.getctime)
-print('Pulling from: {}'.format(latest_file))
-
-con = sqlite3.connect(latest_file) ## kismet DB to point at
-
-def sql_fetch(con):
-
-    cursorObj = con.cursor()
-
-    cursorObj.execute("SELECT devmac FROM devices")
-
-    rows = cursorObj.fetchall()
-
-    for row in rows:
-
-        #print(row)
-        stripped_val = str(row).replace("(","").replace(")","").replace("'","").replace(",","")
-        non_alert_list.append(stripped_val)
-
-sql_fetch(con)
-
-print ('Added {} MACs to the ignore list.'.format(len(non_alert_list)))
-
-# Fix - write to ignore_lists directory
-ignore_list = open(pathlib.Path('./ignore_lists') / config['paths']['ignore_lists']['mac'], "w")
-ignore_list.write("ignore_list = " + str(non_alert_list))
-ignore_list.close()
-
-def grab_all_probes(con): 
-    cursorObj = con.cursor()
-    cursorObj.execute("SELECT devmac, type, device FROM devices") 
-    rows = cursorObj.fetchall()
-    for row in rows:
-        raw_device_json = json.loads(row[2])
-        if 'dot11.probedssid.ssid' in str(row):
-            ssid_probed_for = raw_device_json["dot11.device"]["dot11.device.last_probed_ssid_record"]["dot11.probedssid.ssid"] ### Grabbed SSID Probed for
-            if ssid_probed_for == '':
-                pass
+import time
+from datetime import datetime
+
+import ignore_store
+import kismet_db
+from mac_address import LOCAL_BIT, int_to_mac, parse_mac
+
+MANIFEST_VERSION = 1
+JOURNAL_SUFFIXES = ('-journal', '-wal')  # SQLite leaves these next to a file Kismet still has open
+PENDING_SESSIONS = 10  # Sessions a MAC or SSID under --min-sightings is kept for without being seen again
+
+
+def parse_time(value):
+    """Unix time, or an ISO date/time like 2024-05-01 or 2024-05-01T18:00"""
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def new_manifest():
+    return {'version': MANIFEST_VERSION, 'options': None, 'sessions': {}, 'ingested': 0,
+            'pending_macs': {}, 'pending_ssids': {}}
+
+
+def load_manifest(path):
+    """Ingested sessions, build options and pending sighting counts of a baseline"""
+    if not path.exists():
+        return new_manifest()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        print('Ignoring {}: not a version {} manifest'.format(path, MANIFEST_VERSION))
+        return new_manifest()
+    return manifest
+
+
+def save_manifest(path, manifest):
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def kismet_files(sources, pattern):
+    """.kismet files named on the command line (directories are searched), or every file matching the config glob"""
+    if not sources:
+        return sorted(glob.glob(pattern))
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(sorted(glob.glob(os.path.join(source, '*.kismet'))))
+        else:
+            files.append(source)
+    return files
+
+
+def still_open(path):
+    """True if Kismet has not finished with a log file (its SQLite journal is still there)"""
+    return any(os.path.exists(path + suffix) for suffix in JOURNAL_SUFFIXES)
+
+
+def collect(rows):
+    """(MACs, probed SSIDs) of (devmac, type, last_time, probed_ssid) rows, as sets"""
+    macs = set()
+    ssids = set()
+    for devmac, dev_type, last_time, ssid in rows:
+        mac = parse_mac(devmac)
+        if mac is not None:
+            macs.add(mac)
+        if ssid:
+            ssids.add(ssid)
+    return macs, ssids
+
+
+def file_devices(path, start_time, end_time):
+    con = kismet_db.connect_readonly(path)
+    try:
+        return collect(kismet_db.iter_devices(con, start_time, end_time))
+    finally:
+        con.close()
+
+
+class BaselineBuilder:
+    """Counts the sessions each new MAC and SSID is seen in and collects those
+    seen in at least min_sightings of them
+
+    MACs and SSIDs already in the store are not counted again; the ones still
+    under the threshold carry their counts over in the manifest, so a device
+    seen once a week reaches it over several incremental runs. Pending entries
+    not seen again within pending_sessions sessions are dropped. Locally
+    administered (randomized) MACs are counted like any other, since phones
+    keep a stable private address per network, unless skip_randomized is set.
+    """
+
+    def __init__(self, store, manifest, min_sightings=1, pending_sessions=PENDING_SESSIONS,
+                 skip_randomized=False):
+        self.store = store
+        self.manifest = manifest
+        self.min_sightings = min_sightings
+        self.pending_sessions = pending_sessions
+        self.skip_randomized = skip_randomized
+        self.new_macs = set()
+        self.new_ssids = set()
+        self.expired = 0
+        self.randomized = 0
+
+    def _count(self, values, known, new, pending, key=str):
+        session = self.manifest['ingested']
+        for value in values:
+            if value in new or (known is not None and value in known):
+                continue
+            count = pending.pop(key(value), (0, session))[0] + 1
+            if count >= self.min_sightings:
+                new.add(value)
             else:
-                non_alert_ssid_list.append(ssid_probed_for)
-
-grab_all_probes(con)
-
-print ('Added {} Probed SSIDs to the ignore list.'.format(len(non_alert_ssid_list)))
-# Fix - write to ignore_lists directory
-ignore_list_ssid = open(pathlib.Path('./ignore_lists') / config['paths']['ignore_lists']['ssid'], "w")
-ignore_list_ssid.write("non_alert_ssid_list = " + str(non_alert_ssid_list))
-ignore_list_ssid.close()
+                pending[key(value)] = [count, session]
+
+    def _expire(self, pending):
+        oldest = self.manifest['ingested'] - self.pending_sessions
+        for key in [key for key, (count, session) in pending.items() if session <= oldest]:
+            del pending[key]
+            self.expired += 1
+
+    def ingest(self, macs, ssids):
+        self.manifest['ingested'] += 1
+        if self.skip_randomized:
+            kept = {mac for mac in macs if not mac & LOCAL_BIT}
+            self.randomized += len(macs) - len(kept)
+            macs = kept
+        self._count(macs, self.store.macs if self.store else None, self.new_macs,
+                    self.manifest['pending_macs'], int_to_mac)
+        self._count(ssids, self.store.ssids if self.store else None, self.new_ssids,
+                    self.manifest['pending_ssids'])
+        self._expire(self.manifest['pending_macs'])
+        self._expire(self.manifest['pending_ssids'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge Kismet sessions into the Chasing Your Tail ignore lists')
+    parser.add_argument('sources', nargs='*',
+                        help='Kismet files or directories (default: every file matching paths.kismet_logs)')
+    parser.add_argument('--mirror', nargs='?', const='', metavar='PATH',
+                        help='Also read the sessions in the sidecar mirror (default: the one in config.json); '
+                             'it only holds the devices of the last time window of each session')
+    parser.add_argument('--since', type=parse_time, help='Only devices last seen at or after this time')
+    parser.add_argument('--until', type=parse_time, help='Only devices last seen at or before this time')
+    parser.add_argument('--min-sightings', type=int, default=1,
+                        help='Sessions a MAC or SSID has to be seen in before it is ignored')
+    parser.add_argument('--pending-sessions', type=int, default=PENDING_SESSIONS,
+                        help='Sessions a MAC or SSID under --min-sightings is remembered for without being seen again')
+    parser.add_argument('--skip-randomized', action='store_true',
+                        help='Leave locally administered (randomized) MACs out of the baseline')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Start over from an empty store and manifest instead of merging')
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    ### Check for/make subdirectories for logs, ignore lists etc.
+    cyt_sub = pathlib.Path('./ignore_lists')
+    cyt_sub.mkdir(parents=True, exist_ok=True)
+    store_path = ignore_store.store_path_from_config(config, cyt_sub)
+    manifest_path = store_path.with_suffix('.manifest.json')
+
+    if args.rebuild:
+        manifest = new_manifest()
+        store = None
+    else:
+        manifest = load_manifest(manifest_path)
+        store = ignore_store.open_from_config(config, cyt_sub)
+    options = {'since': args.since, 'until': args.until, 'min_sightings': args.min_sightings,
+               'skip_randomized': args.skip_randomized}
+    if manifest['options'] not in (None, options):
+        print('Note: the sessions already ingested used {}; run with --rebuild to apply the new options to them'.format(
+            manifest['options']))
+    manifest['options'] = options
+    builder = BaselineBuilder(store, manifest, args.min_sightings, args.pending_sessions, args.skip_randomized)
+
+    sessions = [(path, lambda path=path: file_devices(path, args.since, args.until))
+                for path in kismet_files(args.sources, config['paths']['kismet_logs'])]
+    named = {os.path.abspath(source) for source in args.sources}
+    mirror = None
+    if args.mirror is not None:
+        mirror_path = pathlib.Path(args.mirror or pathlib.Path(config['paths']['log_dir']) /
+                                   config.get('database', {}).get('mirror', 'device_mirror.db'))
+        if mirror_path.exists():
+            mirror = kismet_db.DeviceMirror(mirror_path)
+            sessions.extend((path, lambda session=session: collect(mirror.iter_session(session, args.since, args.until)))
+                            for session, path in mirror.sessions())
+        else:
+            print('No sidecar mirror at {}'.format(mirror_path))
+
+    started = time.time()
+    ingested = skipped = 0
+    for path, load in sessions:
+        key = os.path.abspath(path)
+        if key in manifest['sessions']:
+            skipped += 1
+            continue
+        if still_open(path):
+            if key not in named:
+                print('Skipping {}: Kismet is still writing it (name it on the command line to read it anyway)'.format(path))
+                continue
+            print('Note: Kismet still has {} open, reading what it has written so far'.format(path))
+        macs, ssids = load()
+        builder.ingest(macs, ssids)
+        manifest['sessions'][key] = {'ingested': int(time.time()), 'macs': len(macs), 'ssids': len(ssids)}
+        ingested += 1
+        print('Ingested {}: {} MACs, {} Probed SSIDs'.format(path, len(macs), len(ssids)))
+    if mirror is not None:
+        mirror.close()
+
+    if store is not None:
+        store.close()
+    if args.rebuild:
+        mac_count, ssid_count, invalid = ignore_store.write_store(store_path, builder.new_macs, builder.new_ssids)
+    else:
+        mac_count, ssid_count, invalid = ignore_store.merge_store(store_path, builder.new_macs, builder.new_ssids)
+    save_manifest(manifest_path, manifest)
+
+    print('Added {} MACs and {} Probed SSIDs from {} new session(s) ({} already ingested) in {:.1f}s'.format(
+        len(builder.new_macs), len(builder.new_ssids), ingested, skipped, time.time() - started))
+    if builder.randomized:
+        print('Skipped {} randomized MAC sightings'.format(builder.randomized))
+    if args.min_sightings > 1:
+        print('{} MACs and {} Probed SSIDs seen in fewer than {} sessions so far ({} not seen in {} sessions dropped)'.format(
+            len(manifest['pending_macs']), len(manifest['pending_ssids']), args.min_sightings,
+            builder.expired, args.pending_sessions))
+    print('Wrote {} ({} MACs, {} Probed SSIDs)'.format(store_path, mac_count, ssid_count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+### Clocks for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import time
+
+
+class SystemClock:
+    """Wall clock used for live monitoring"""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def running(self):
+        return True
+
+
+class SimulatedClock:
+    """Clock whose sleep() advances instantly, for replaying hours in seconds
+
+    Args:
+        start: Unix timestamp the simulation starts at
+        until: Optional unix timestamp at which running() turns False
+        on_sleep: Optional callback run with the new time after every sleep(),
+            e.g. to let a synthetic Kismet database catch up
+    """
+
+    def __init__(self, start, until=None, on_sleep=None):
+        self.now = float(start)
+        self.until = until
+        self.on_sleep = on_sleep
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep(self.now)
+
+    def running(self):
+        return self.until is None or self.now < self.until
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Replace the clock chasing_your_tail.py picks up (call before it starts)"""
+    global _clock
+    _clock = clock
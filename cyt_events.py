@@ -0,0 +1,134 @@
+### Structured event log for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import atexit
+import json
+import pathlib
+import time
+
+DEFAULT_LOGGING = {
+    'max_bytes': 10 * 1024 * 1024,  # Rotate after 10 MB
+    'max_age': 24 * 60 * 60,        # or after a day
+    'batch_size': 200,              # Records held in memory before a write
+    'flush_interval': 5,            # Seconds a record may wait before a write
+}
+
+
+class EventLog:
+    """Batched JSONL event writer with size and time based rotation
+
+    Every record is one JSON object per line with at least ts (unix time) and
+    type (alert, probe, rotation, stats or status). Records are queued in memory
+    and written in one call once batch_size records are waiting or the oldest
+    has waited flush_interval seconds, which keeps SD card writes to a minimum.
+    The queue is bounded by batch_size; a full queue is flushed immediately
+    rather than dropping records. close() (also run at exit) flushes the rest.
+    """
+
+    def __init__(self, log_dir, prefix='cyt_log', max_bytes=DEFAULT_LOGGING['max_bytes'],
+                 max_age=DEFAULT_LOGGING['max_age'], batch_size=DEFAULT_LOGGING['batch_size'],
+                 flush_interval=DEFAULT_LOGGING['flush_interval'], echo=False, clock=time):
+        self.log_dir = pathlib.Path(log_dir)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self.clock = clock  # Anything with a time() method
+        self._queue = []
+        self._oldest = None
+        self._file = None
+        self._closed = False
+        self._open_new_file()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Build an event log from the paths.log_dir and logging sections of config.json"""
+        settings = dict(DEFAULT_LOGGING)
+        settings.update(config.get('logging', {}))
+        settings.update(kwargs)
+        return cls(config['paths']['log_dir'], **settings)
+
+    @property
+    def path(self):
+        return self._path
+
+    def _open_new_file(self):
+        if self._file is not None:
+            self._file.close()
+        self._opened = self.clock.time()
+        name = '{}_{}.jsonl'.format(self.prefix, time.strftime("%m%d%y_%H%M%S"))
+        self._path = self.log_dir / name
+        suffix = 1
+        while self._path.exists():
+            self._path = self.log_dir / '{}_{}.jsonl'.format(name[:-6], suffix)
+            suffix += 1
+        self._file = open(self._path, 'a', encoding='utf-8')
+        self._size = 0
+
+    def emit(self, event_type, message=None, ts=None, **fields):
+        """Queue a record of the given type (ts defaults to now)"""
+        if self._closed:
+            return
+        now = self.clock.time()
+        record = {'ts': round(now if ts is None else ts, 3), 'type': event_type}
+        record.update(fields)
+        if message is not None:
+            record['msg'] = message
+            if self.echo:
+                print(message)
+        if self._oldest is None:
+            self._oldest = now
+        self._queue.append(json.dumps(record, ensure_ascii=False, default=str))
+        if len(self._queue) >= self.batch_size or now - self._oldest >= self.flush_interval:
+            self.flush()
+
+    def status(self, message, **fields):
+        self.emit('status', message, **fields)
+
+    def alert(self, level, mac, dev_type, window, message, probed_ssid=None, ts=None, **fields):
+        self.emit('alert', message, ts=ts, level=level, mac=mac, device_type=dev_type,
+                  window=window, probed_ssid=probed_ssid, **fields)
+
+    def probe(self, ssid, mac=None):
+        self.emit('probe', 'Found a probe!: {}'.format(ssid), ssid=ssid, mac=mac)
+
+    def rotation(self, windows):
+        """Window sizes after a rotation, as (label, MAC count, SSID count) tuples"""
+        self.emit('rotation', windows=[{'window': label, 'macs': macs, 'ssids': ssids}
+                                       for label, macs, ssids in windows])
+
+    def stats(self, **fields):
+        self.emit('stats', **fields)
+
+    def maybe_flush(self, within=0):
+        """Flush if the oldest queued record will have waited flush_interval seconds within `within` seconds
+
+        emit() only checks the age of the queue when a new record arrives, so
+        the main loop calls this before it sleeps with within=check_interval:
+        records that would otherwise wait out the sleep are written now.
+        """
+        if self._oldest is not None and self.clock.time() + within - self._oldest >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._queue or self._file is None:
+            return
+        data = '\n'.join(self._queue) + '\n'
+        self._queue = []
+        self._oldest = None
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        if self._size >= self.max_bytes or self.clock.time() - self._opened >= self.max_age:
+            self._open_new_file()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._file.close()
@@ -0,0 +1,111 @@
+### GPS position (from gpsd) for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import json
+import math
+import socket
+import threading
+import time
+
+EARTH_RADIUS_M = 6371000
+FIX_MAX_AGE = 10  # Seconds a fix counts as the current position
+GPSD_HOST = 'localhost'
+GPSD_PORT = 2947
+RECONNECT_SECONDS = 5
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great circle (haversine) distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class GpsdReader:
+    """Current position from gpsd (the gps section of config.json)
+
+    gpsd owns the GPS device (monitor.sh checks it the same way), so the
+    position is read from its JSON watch stream instead of opening the serial
+    port. A background thread keeps the last 2D/3D fix from TPV reports and
+    reconnects if gpsd goes away; position is None until there is a fix, when
+    it is older than FIX_MAX_AGE, or when gpsd reports fewer than
+    min_satellites satellites in use.
+    """
+
+    def __init__(self, host=GPSD_HOST, port=GPSD_PORT, min_satellites=0, clock=time):
+        self.host = host
+        self.port = port
+        self.min_satellites = min_satellites
+        self.clock = clock
+        self.last_error = None
+        self._fix = None
+        self._fix_time = None
+        self._satellites = None
+        self._socket = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='gpsd', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, clock=time):
+        """A reader for the gps section of config.json, or None if GPS is off"""
+        settings = config.get('gps', {})
+        if not settings.get('enabled'):
+            return None
+        return cls(settings.get('gpsd_host', GPSD_HOST), settings.get('gpsd_port', GPSD_PORT),
+                   settings.get('min_satellites', 0), clock)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._socket = socket.create_connection((self.host, self.port), timeout=RECONNECT_SECONDS)
+                self._socket.settimeout(None)
+                self._socket.sendall(b'?WATCH={"enable":true,"json":true}\n')
+                with self._socket.makefile('rb') as reports:
+                    for line in reports:
+                        self._report(line)
+                self.last_error = 'gpsd closed the connection'
+            except (OSError, ValueError) as e:
+                self.last_error = str(e)
+            finally:
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+            self._stop.wait(RECONNECT_SECONDS)
+
+    def _report(self, line):
+        try:
+            report = json.loads(line)
+        except ValueError:
+            return
+        if report.get('class') == 'SKY':
+            if 'uSat' in report:
+                self._satellites = report['uSat']
+            elif 'satellites' in report:
+                self._satellites = sum(1 for sat in report['satellites'] if sat.get('used'))
+        elif report.get('class') == 'TPV' and report.get('mode', 0) >= 2 \
+                and 'lat' in report and 'lon' in report:
+            if self.min_satellites and self._satellites is not None and self._satellites < self.min_satellites:
+                return
+            self._fix = (report['lat'], report['lon'])
+            self._fix_time = self.clock.time()
+
+    @property
+    def position(self):
+        """(lat, lon) of a recent fix, or None"""
+        if self._fix is None or self.clock.time() - self._fix_time > FIX_MAX_AGE:
+            return None
+        return self._fix
+
+    def close(self):
+        self._stop.set()
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread.join(1)
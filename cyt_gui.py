@@ -22,6 +22,8 @@ import tempfile
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+import ignore_store
+
 # Load config
 with open('config.json', 'r') as f:
     config = json.load(f)
@@ -306,27 +308,54 @@ class ChasingYourTailGUI:
             self.log_output(f"Error updating display: {e}")
 
     def load_ignore_lists(self):
-        """Load ignore lists from files"""
+        """Load the ignore list entries managed here (mac_ignore.txt, ssid_ignore.txt)
+
+        Entries are also saved to the ignore store chasing_your_tail.py uses.
+        That store can hold a whole baseline, so only its size is shown.
+        """
+        self.ignore_store_path = ignore_store.store_path_from_config(self.config)
+        self.saved_ignores = {'mac': set(), 'ssid': set()}  # Entries already in the store
         try:
-            # Load MAC addresses
-            if os.path.exists('mac_ignore.txt'):
-                with open('mac_ignore.txt', 'r') as f:
-                    for line in f:
-                        mac = line.strip()
-                        if mac:
-                            self.mac_listbox.insert(tk.END, mac)
-            
-            # Load SSIDs
-            if os.path.exists('ssid_ignore.txt'):
-                with open('ssid_ignore.txt', 'r') as f:
-                    for line in f:
-                        ssid = line.strip()
-                        if ssid:
-                            self.ssid_listbox.insert(tk.END, ssid)
+            store = ignore_store.IgnoreStore(self.ignore_store_path) if self.ignore_store_path.exists() else None
+            try:
+                # Load MAC addresses
+                if os.path.exists('mac_ignore.txt'):
+                    with open('mac_ignore.txt', 'r') as f:
+                        for line in f:
+                            mac = line.strip()
+                            if mac:
+                                self.mac_listbox.insert(tk.END, mac)
+                                if store is not None and mac in store.macs:  # Else added on the next save
+                                    self.saved_ignores['mac'].add(mac)
+                
+                # Load SSIDs
+                if os.path.exists('ssid_ignore.txt'):
+                    with open('ssid_ignore.txt', 'r') as f:
+                        for line in f:
+                            ssid = line.strip()
+                            if ssid:
+                                self.ssid_listbox.insert(tk.END, ssid)
+                                if store is not None and ssid in store.ssids:
+                                    self.saved_ignores['ssid'].add(ssid)
+            finally:
+                if store is not None:
+                    store.close()
+            self.log_ignore_store_size()
                             
         except Exception as e:
             self.log_output(f"Error loading ignore lists: {e}")
 
+    def log_ignore_store_size(self):
+        """Log how many MACs and SSIDs the shared ignore store holds"""
+        if not self.ignore_store_path.exists():
+            self.log_output(f"No ignore store at {self.ignore_store_path} yet")
+            return
+        store = ignore_store.IgnoreStore(self.ignore_store_path)
+        try:
+            self.log_output(f"Ignore store {self.ignore_store_path}: {len(store.macs)} MACs, {len(store.ssids)} Probed SSIDs")
+        finally:
+            store.close()
+
     def load_config(self):
         """Load configuration from file"""
         try:
@@ -732,16 +761,27 @@ class ChasingYourTailGUI:
             self.log_output(f"Error adding to ignore list: {e}")
 
     def save_ignore_list(self, list_type):
-        """Save ignore list to file"""
+        """Save ignore list to the ignore store (a running chasing_your_tail.py picks it up)"""
         try:
-            filename = 'mac_ignore.txt' if list_type == 'mac' else 'ssid_ignore.txt'
             listbox = self.mac_listbox if list_type == 'mac' else self.ssid_listbox
+            entries = set(listbox.get(0, tk.END))
+            added = entries - self.saved_ignores[list_type]
+            removed = self.saved_ignores[list_type] - entries
             
+            filename = 'mac_ignore.txt' if list_type == 'mac' else 'ssid_ignore.txt'
             with open(filename, 'w') as f:
                 for i in range(listbox.size()):
                     f.write(listbox.get(i) + '\n')
+            
+            self.ignore_store_path.parent.mkdir(parents=True, exist_ok=True)
+            if list_type == 'mac':
+                ignore_store.merge_store(self.ignore_store_path, added, (), remove_macs=removed)
+            else:
+                ignore_store.merge_store(self.ignore_store_path, (), added, remove_ssids=removed)
+            self.saved_ignores[list_type] = entries
                 
             self.log_output(f"Saved {list_type} ignore list")
+            self.log_ignore_store_size()
             
         except Exception as e:
             self.log_output(f"Error saving ignore list: {e}")
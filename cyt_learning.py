@@ -0,0 +1,178 @@
+### Learning mode (live baseline capture) for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import pathlib
+import time
+
+import ignore_store
+from cyt_gps import FIX_MAX_AGE, distance_m
+
+DEFAULT_LEARNING = {
+    'minutes': 0,           # Learn for this long after starting (0 for no time limit)
+    'geofence': None,       # or {"lat": ..., "lon": ..., "radius_m": ...}: learn until the sensor leaves it
+    'flush_interval': 60,   # Seconds between writes of what was learned to the ignore store
+    'max_no_fix': 300,      # Seconds a geofence phase goes on without a GPS fix before it ends
+}
+WARN_INTERVAL = 60  # Seconds between warnings while a geofence phase has no GPS fix
+
+
+def parse_geofence(value):
+    """'LAT,LON,RADIUS_M' from the command line to a geofence dict"""
+    lat, lon, radius_m = (float(part) for part in value.split(','))
+    return {'lat': lat, 'lon': lon, 'radius_m': radius_m}
+
+
+class LearningPhase:
+    """Adds every device seen to the ignore lists until the baseline period ends
+
+    While active, MACs and probed SSIDs go straight into the learned sets of
+    the live MacFilter/SsidFilter, so the next cycle already ignores them, and
+    are merged into the ignore store on disk every flush_interval seconds (and
+    when the phase ends). The phase ends after `minutes`, or once the GPS
+    position is outside the geofence, whichever comes first; after that the
+    caller alerts as usual, with nothing restarted or read again.
+
+    A geofence phase without a GPS fix cannot tell whether the sensor has
+    left, so what it learns meanwhile is held back from the ignore store and,
+    if there is still no fix after max_no_fix seconds, the phase ends and
+    those entries are dropped again instead of being trusted.
+
+    Args:
+        mac_filter: ignore_store.MacFilter the engine checks MACs against
+        ssid_filter: ignore_store.SsidFilter the engine checks probed SSIDs against
+        store_path: Ignore store to persist learned entries to
+        minutes: Length of the phase (0 for no time limit)
+        geofence: {"lat", "lon", "radius_m"} to learn inside of
+        gps: Position source (cyt_gps.GpsdReader) for the geofence
+        max_no_fix: Seconds without a GPS fix before a geofence phase ends
+    """
+
+    def __init__(self, mac_filter, ssid_filter, store_path, minutes=0, geofence=None, gps=None,
+                 flush_interval=DEFAULT_LEARNING['flush_interval'], clock=time,
+                 max_no_fix=DEFAULT_LEARNING['max_no_fix']):
+        self.mac_filter = mac_filter
+        self.ssid_filter = ssid_filter
+        self.store_path = store_path
+        self.clock = clock
+        self.ends = clock.time() + minutes * 60 if minutes else None
+        self.geofence = geofence
+        self.gps = gps
+        self.flush_interval = flush_interval
+        self.max_no_fix = max_no_fix
+        self.finished = None  # Why the phase ended, once it has
+        self.no_fix_since = clock.time() if geofence else None  # When a geofence phase lost (or has yet to get) a GPS fix
+        self._last_warning = None
+        self._macs = []       # Learned since the last flush (or held back without a fix)
+        self._ssids = []
+        self._last_flush = clock.time()
+        self.learned_macs = 0
+        self.learned_ssids = 0
+        self.last_error = None
+
+    @classmethod
+    def from_config(cls, config, mac_filter, ssid_filter, store_path, gps=None, clock=time, **overrides):
+        """A learning phase from the learning section of config.json (and command line
+        overrides), or None if it has no way to end"""
+        settings = dict(DEFAULT_LEARNING)
+        settings.update(config.get('learning', {}))
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        geofence = settings['geofence'] or None
+        if geofence and gps is None:
+            geofence = None  # No position to check it against
+        if not settings['minutes'] and not geofence:
+            return None
+        return cls(mac_filter, ssid_filter, store_path, settings['minutes'], geofence, gps,
+                   settings['flush_interval'], clock, settings['max_no_fix'])
+
+    def describe(self):
+        reasons = []
+        if self.ends is not None:
+            reasons.append('for {:.0f} min'.format((self.ends - self.clock.time()) / 60))
+        if self.geofence:
+            reasons.append('while within {radius_m:.0f} m of {lat:.5f},{lon:.5f}'.format(**self.geofence))
+        return ' or '.join(reasons)
+
+    def active(self):
+        """True while still learning; the first call after the phase ends flushes and returns False"""
+        if self.finished is not None:
+            return False
+        now = self.clock.time()
+        if self.ends is not None and now >= self.ends:
+            self.finished = 'time limit reached'
+        elif self.geofence:
+            position = self.gps.position
+            if position is None:
+                if self.no_fix_since is None:
+                    self.flush()  # Everything up to now was learned with a fix
+                    self.no_fix_since = now
+                elif now - self.no_fix_since >= self.max_no_fix:
+                    self.finished = 'no GPS fix for {:.0f} s'.format(now - self.no_fix_since)
+            else:
+                self.no_fix_since = None
+                if distance_m(position[0], position[1], self.geofence['lat'],
+                              self.geofence['lon']) > self.geofence['radius_m']:
+                    self.finished = 'left the geofence'
+        if self.finished is not None:
+            if self.no_fix_since is not None:
+                self._drop_held()
+            self.flush()
+            return False
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+        return True
+
+    def learn(self, mac, ssid=None):
+        """Ignore a MAC (integer) and the SSID it probed for from now on"""
+        if mac is not None and mac not in self.mac_filter:
+            self.mac_filter.learned.add(mac)
+            self._macs.append(mac)
+            self.learned_macs += 1
+        if ssid and ssid not in self.ssid_filter:
+            self.ssid_filter.learned.add(ssid)
+            self._ssids.append(ssid)
+            self.learned_ssids += 1
+
+    def fix_warning(self):
+        """A warning to show while a geofence phase has no GPS fix, at most every WARN_INTERVAL seconds"""
+        if self.no_fix_since is None or self.finished is not None:
+            return None
+        now = self.clock.time()
+        if now - self.no_fix_since < FIX_MAX_AGE:
+            return None  # gpsd may just not have reported yet
+        if self._last_warning is not None and now - self._last_warning < WARN_INTERVAL:
+            return None
+        self._last_warning = now
+        return 'No GPS fix for {:.0f} s ({}): holding back {} MACs and {} Probed SSIDs learned meanwhile, ' \
+               'learning ends after {:.0f} s without a fix'.format(
+                   now - self.no_fix_since, getattr(self.gps, 'last_error', None) or 'no position',
+                   len(self._macs), len(self._ssids), self.max_no_fix)
+
+    def _drop_held(self):
+        """Take back what was learned without a GPS fix, from the live filters as well"""
+        self.mac_filter.learned.difference_update(self._macs)
+        self.ssid_filter.learned.difference_update(self._ssids)
+        self.learned_macs -= len(self._macs)
+        self.learned_ssids -= len(self._ssids)
+        self._macs = []
+        self._ssids = []
+
+    def flush(self):
+        """Merge what was learned since the last flush into the ignore store
+
+        Nothing is written while a geofence phase has no GPS fix.
+        """
+        self._last_flush = self.clock.time()
+        if self.no_fix_since is not None:
+            return
+        if not self._macs and not self._ssids:
+            return
+        try:
+            pathlib.Path(self.store_path).parent.mkdir(parents=True, exist_ok=True)
+            ignore_store.merge_store(self.store_path, self._macs, self._ssids)
+        except OSError as e:
+            self.last_error = str(e)  # Kept in memory and retried at the next flush
+            return
+        self.last_error = None
+        self._macs = []
+        self._ssids = []
@@ -0,0 +1,183 @@
+### Hot-path metrics for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import contextlib
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.9, 0.99)
+RESERVOIR_SIZE = 1024  # Most recent samples kept per timer for the quantiles
+
+
+class Metrics:
+    """Counters, gauges and timers exported in the Prometheus text format
+
+    Timers keep their most recent samples and are exported as summaries with
+    p50/p90/p99 plus _sum and _count, which is all we need to size hardware
+    without pulling in a client library.
+    """
+
+    def __init__(self, prefix='cyt'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}  # name -> [deque of samples, total seconds, count]
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = [deque(maxlen=RESERVOIR_SIZE), 0.0, 0]
+            timer[0].append(seconds)
+            timer[1] += seconds
+            timer[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, name):
+        """Time the enclosed block into the named timer"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def render(self):
+        """Current values in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = '{}_{}_total'.format(self.prefix, name)
+                lines.append('# TYPE {} counter'.format(metric))
+                lines.append('{} {}'.format(metric, value))
+            seen = set()
+            for (name, labels), value in sorted(self._gauges.items()):
+                metric = '{}_{}'.format(self.prefix, name)
+                if metric not in seen:
+                    lines.append('# TYPE {} gauge'.format(metric))
+                    seen.add(metric)
+                label_text = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+                lines.append('{}{} {}'.format(metric, '{' + label_text + '}' if label_text else '', value))
+            for name, (samples, total, count) in sorted(self._timers.items()):
+                metric = '{}_{}_seconds'.format(self.prefix, name)
+                ordered = sorted(samples)
+                lines.append('# TYPE {} summary'.format(metric))
+                for q in QUANTILES:
+                    if ordered:
+                        value = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                        lines.append('{}{{quantile="{}"}} {:.6f}'.format(metric, q, value))
+                lines.append('{}_sum {:.6f}'.format(metric, total))
+                lines.append('{}_count {}'.format(metric, count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically write the metrics for node_exporter's textfile collector"""
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def _handler(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_http(self, port, host='127.0.0.1'):
+        """Serve the metrics over HTTP on a daemon thread"""
+        server = ThreadingHTTPServer((host, port), self._handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def serve_unix(self, path):
+        """Serve the metrics over HTTP on a Unix socket on a daemon thread"""
+        if os.path.exists(path):
+            os.unlink(path)
+
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        server = UnixHTTPServer(path, self._handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class TimedIterator:
+    """Iterator over function(*args, **kwargs) that times only producing the items
+
+    For streamed rows, where the fetch happens a page at a time while the
+    caller works through them: seconds covers the call and every next(), not
+    the caller's work in between.
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        started = time.perf_counter()
+        self._iterator = iter(function(*args, **kwargs))
+        self.seconds = time.perf_counter() - started
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+        self.count += 1
+        return item
+
+
+class NullMetrics(Metrics):
+    """Metrics that record nothing, for when metrics are turned off"""
+
+    def inc(self, name, value=1):
+        pass
+
+    def set(self, name, value, **labels):
+        pass
+
+    def observe(self, name, seconds):
+        pass
+
+    @contextlib.contextmanager
+    def time(self, name):
+        yield
+
+
+def from_config(config):
+    """Metrics (and their exporters) from the metrics section of config.json"""
+    settings = config.get('metrics', {})
+    if not settings.get('enabled', True):
+        return NullMetrics()
+    metrics = Metrics()
+    if settings.get('http_port'):
+        metrics.serve_http(int(settings['http_port']), settings.get('http_host', '127.0.0.1'))
+    if settings.get('unix_socket'):
+        metrics.serve_unix(settings['unix_socket'])
+    return metrics
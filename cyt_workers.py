@@ -0,0 +1,200 @@
+### Worker pool for decoding Kismet rows on several cores for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import kismet_db
+import pcap_source
+
+DEFAULT_WORKERS = {
+    'processes': 0,    # Worker processes, 0 runs everything in-process
+    'min_rows': 2000,  # Fewer rows than this are cheaper to decode in-process
+}
+
+_connections = {}  # Worker side: database file -> read-only connection, kept between cycles
+
+
+def _connection(path, busy_timeout_ms):
+    con = _connections.get(path)
+    if con is None:
+        con = _connections[path] = kismet_db.connect_readonly(path, busy_timeout_ms)
+    return con
+
+
+def _run_shard(task):
+    """Worker side: run one rowid range of a query on the worker's own connection"""
+    kind, path, busy_timeout_ms, rowid_range, args = task
+    con = _connection(path, busy_timeout_ms)
+    if kind == 'devices':
+        return kismet_db.fetch_devices(con, *args, rowid_range=rowid_range)
+    if kind == 'mirror':
+        return list(kismet_db.mirror_rows(con, 'main', *args, rowid_range=rowid_range))
+    return kismet_db.fetch_fingerprints(con, *args, rowid_range=rowid_range)
+
+
+def _iter_log(path, fetch):
+    """Rows of fetch(con) over a finished Kismet log, streamed on a connection of their own"""
+    con = kismet_db.connect_readonly(path)
+    try:
+        yield from fetch(con)
+    finally:
+        con.close()
+
+
+def _read_log(path):
+    """Worker side: sightings and fingerprints of one finished Kismet log or packet capture, as lists"""
+    if path.endswith(pcap_source.CAPTURE_SUFFIXES):
+        return pcap_source.read_capture(path)
+    con = kismet_db.connect_readonly(path)
+    try:
+        return kismet_db.fetch_sightings(con), kismet_db.fetch_fingerprints(con)
+    finally:
+        con.close()
+
+
+class DecodePool:
+    """Splits device queries by rowid across worker processes
+
+    The JSON extraction (or the Python blob decode without JSON1) is the
+    expensive part of a fetch, so a busy cycle first reads just the rowids in
+    the time range, cuts them into one contiguous range per worker and has each
+    worker run the normal query over its range on its own read-only connection.
+    Results are joined in range order (sessions newest first, then rowid), the
+    same order the single query returns, so the merge is deterministic whatever
+    order the workers finish in. Small cycles, or a pool of 0 processes, run
+    the query in-process.
+
+    With the sidecar mirror on, queries read CYT's own indexed table and the
+    extraction happens when KismetReader.refresh() syncs the mirror instead, so
+    a big sync is split the same way by rowid (mirror_rows()).
+
+    Workers are forked: chasing_your_tail.py does its work at module level, so
+    a spawned worker would run it again.
+
+    Args:
+        processes: Number of worker processes (0 for none)
+        min_rows: Minimum rows in a fetch before it is split across workers
+        busy_timeout_ms: Busy timeout of the workers' connections
+    """
+
+    def __init__(self, processes=DEFAULT_WORKERS['processes'], min_rows=DEFAULT_WORKERS['min_rows'],
+                 busy_timeout_ms=kismet_db.DEFAULT_BUSY_TIMEOUT_MS):
+        self.processes = processes
+        self.min_rows = min_rows
+        self.busy_timeout_ms = busy_timeout_ms
+        self._executor = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a pool from the workers and database sections of config.json"""
+        settings = dict(DEFAULT_WORKERS)
+        settings.update(config.get('workers', {}))
+        busy_timeout_ms = config.get('database', {}).get('busy_timeout_ms', kismet_db.DEFAULT_BUSY_TIMEOUT_MS)
+        return cls(settings['processes'], settings['min_rows'], busy_timeout_ms)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('fork'))
+        return self._executor
+
+    def _shards(self, con, start_time, end_time):
+        """(database file, rowid range) per worker task, or None to run in-process"""
+        if self.processes <= 0 or kismet_db.has_table(con, kismet_db.MIRROR_TABLE):
+            return None  # No workers, or an indexed mirror with nothing to decode
+        files = {name: filename for seq, name, filename in con.execute("PRAGMA database_list")}
+        where = []
+        params = []
+        if start_time is not None:
+            where.append("last_time >= ?")
+            params.append(start_time)
+        if end_time is not None:
+            where.append("last_time <= ?")
+            params.append(end_time)
+
+        rowids = []
+        for schema in kismet_db.device_schemas(con):
+            if not files.get(schema):
+                return None  # In-memory database, workers cannot open it
+            query = "SELECT rowid FROM {}.devices".format(schema)
+            if where:
+                query += " WHERE " + " AND ".join(where)
+            rowids.append((schema, [row[0] for row in con.execute(query + " ORDER BY rowid", params)]))
+        if sum(len(ids) for schema, ids in rowids) < self.min_rows:
+            return None
+
+        shards = []
+        for schema, ids in rowids:
+            size = math.ceil(len(ids) / self.processes)
+            for i in range(0, len(ids), size):
+                chunk = ids[i:i + size]
+                # Rows Kismet writes after the rowid scan land past the end of main
+                last = None if schema == 'main' and i + size >= len(ids) else chunk[-1]
+                shards.append((files[schema], (chunk[0], last)))
+        return shards
+
+    def _map(self, kind, shards, args):
+        tasks = [(kind, path, self.busy_timeout_ms, rowid_range, args) for path, rowid_range in shards]
+        rows = []
+        for shard_rows in self._pool().map(_run_shard, tasks):
+            rows.extend(shard_rows)
+        return rows
+
+    def fetch_devices(self, con, start_time=None, end_time=None):
+        """kismet_db.fetch_devices(), split across the workers when the fetch is big
+
+        In-process this is kismet_db.iter_devices(), so the rows are streamed a
+        page at a time; split across workers they come back as one list.
+        """
+        shards = self._shards(con, start_time, end_time)
+        if shards is None:
+            return kismet_db.iter_devices(con, start_time, end_time)
+        return self._map('devices', shards, (start_time, end_time))
+
+    def fetch_fingerprints(self, con, start_time=None):
+        """kismet_db.fetch_fingerprints(), split across the workers when the fetch is big (streamed in-process)"""
+        shards = self._shards(con, start_time, None)
+        if shards is None:
+            return kismet_db.iter_fingerprints(con, start_time)
+        return self._map('fingerprints', shards, (start_time,))
+
+    def mirror_rows(self, con, schema, session, since, first_rowid, newest_rowid):
+        """kismet_db.mirror_rows() from first_rowid on, split across the workers when the sync is big
+
+        The rowids from first_rowid to newest_rowid are cut into one range per
+        worker (the last one open, for rows Kismet writes meanwhile) and the
+        results joined in rowid order; in-process the rows are streamed.
+        """
+        path = None
+        if self.processes > 0 and newest_rowid - first_rowid >= self.min_rows:
+            files = {name: filename for seq, name, filename in con.execute("PRAGMA database_list")}
+            path = files.get(schema)
+        if not path:
+            return kismet_db.mirror_rows(con, schema, session, since, (first_rowid, None))
+        size = math.ceil((newest_rowid - first_rowid + 1) / self.processes)
+        shards = []
+        for first in range(first_rowid, newest_rowid + 1, size):
+            last = first + size - 1
+            shards.append((path, (first, last if last < newest_rowid else None)))
+        return self._map('mirror', shards, (session, since))
+
+    def read_logs(self, paths):
+        """(sightings, fingerprints) of each finished log or capture, one per worker, in path order
+
+        In-process the Kismet logs' sightings and fingerprints are generators
+        (kismet_db.iter_sightings() and iter_fingerprints()) that stream from
+        the file as they are consumed; only worker results come back as lists.
+        Captures are parsed whole either way, since their sightings are sorted.
+        """
+        if self.processes <= 0 or len(paths) < 2:
+            return [pcap_source.read_capture(path) if path.endswith(pcap_source.CAPTURE_SUFFIXES) else
+                    (_iter_log(path, kismet_db.iter_sightings), _iter_log(path, kismet_db.iter_fingerprints))
+                    for path in paths]
+        return list(self._pool().map(_read_log, paths))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+### Binary ignore lists for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import argparse
+import ast
+import bisect
+import hashlib
+import itertools
+import mmap
+import os
+import pathlib
+import struct
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows
+    fcntl = None
+
+from mac_address import MAC_MAX, MacRules, int_to_mac, mac_to_int, parse_mac
+
+### File layout: header, then sorted fixed-width big-endian records, so byte
+### order equals numeric order and lookups bisect straight over the mmap.
+###   header:  magic, version, MAC count, SSID hash count
+###   MACs:    6 bytes each (48-bit)
+###   SSIDs:   8 bytes each (first 8 bytes of blake2b of the UTF-8 SSID)
+STORE_MAGIC = b'CYTI'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('>4sHQQ')
+MAC_WIDTH = 6
+SSID_WIDTH = 8
+
+
+def ssid_hash(ssid):
+    return hashlib.blake2b(ssid.encode('utf-8', errors='surrogateescape'), digest_size=SSID_WIDTH).digest()
+
+
+class _Records:
+    """Sequence view of fixed-width records in a buffer, for bisect"""
+
+    def __init__(self, buf, offset, count, width):
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+        self.width = width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.width
+        return self.buf[start:start + self.width]
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self, key)
+        return i < self.count and self[i] == key
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class MacSet:
+    """Membership of MACs (integers or strings) in the sorted MAC records"""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, mac):
+        try:
+            if isinstance(mac, str):
+                mac = mac_to_int(mac)
+            return mac.to_bytes(MAC_WIDTH, 'big') in self.records
+        except (ValueError, AttributeError, OverflowError):
+            return False
+
+    def __iter__(self):
+        for record in self.records:
+            yield int_to_mac(int.from_bytes(record, 'big'))
+
+
+class SsidSet:
+    """Membership of SSIDs in the sorted SSID hash records"""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, ssid):
+        if not ssid:
+            return False
+        return ssid_hash(ssid) in self.records
+
+
+class MacFilter:
+    """Exact ignored MACs plus OUI/prefix/mask rules, for integer MACs
+
+    learned holds MACs added while running (learning mode) on top of the store.
+    """
+
+    def __init__(self, exact=frozenset(), rules=None):
+        self.exact = exact
+        self.rules = rules if rules is not None else MacRules()
+        self.learned = set()
+
+    def __len__(self):
+        return len(self.exact) + len(self.rules) + len(self.learned)
+
+    def __contains__(self, mac):
+        return mac in self.rules or mac in self.exact or mac in self.learned
+
+
+class SsidFilter:
+    """Ignored probed SSIDs: the store's, plus those learned while running"""
+
+    def __init__(self, known=frozenset()):
+        self.known = known
+        self.learned = set()
+
+    def __len__(self):
+        return len(self.known) + len(self.learned)
+
+    def __contains__(self, ssid):
+        return ssid in self.learned or ssid in self.known
+
+
+class IgnoreStore:
+    """Memory-mapped MAC and probed SSID ignore lists with O(log n) lookups
+
+    Use `mac in store.macs` and `ssid in store.ssids`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, mac_count, ssid_count = STORE_HEADER.unpack_from(self._mmap)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            self._mmap.close()
+            raise ValueError('{} is not a version {} CYT ignore list'.format(path, STORE_VERSION))
+        mac_offset = STORE_HEADER.size
+        ssid_offset = mac_offset + mac_count * MAC_WIDTH
+        self.macs = MacSet(_Records(self._mmap, mac_offset, mac_count, MAC_WIDTH))
+        self.ssids = SsidSet(_Records(self._mmap, ssid_offset, ssid_count, SSID_WIDTH))
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_store(path, macs, ssids, ssid_hashes=()):
+    """Atomically write an ignore store from iterables of MACs (strings or integers) and SSIDs
+
+    ssid_hashes are SSIDs already hashed, e.g. read back from a store.
+    Returns:
+        (MACs written, SSIDs written, entries skipped as invalid)
+    """
+    skipped = 0
+    mac_values = set()
+    for mac in macs:
+        value = parse_mac(mac)
+        if value is None or not 0 <= value <= MAC_MAX:
+            skipped += 1
+        else:
+            mac_values.add(value)
+    ssid_values = {ssid_hash(ssid) for ssid in ssids if ssid}
+    ssid_values.update(ssid_hashes)
+
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(mac_values), len(ssid_values)))
+        f.write(b''.join(value.to_bytes(MAC_WIDTH, 'big') for value in sorted(mac_values)))
+        f.write(b''.join(sorted(ssid_values)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(mac_values), len(ssid_values), skipped
+
+
+def merge_store(path, macs=(), ssids=(), remove_macs=(), remove_ssids=()):
+    """Add MACs and SSIDs to (and remove others from) an ignore store, creating it if missing
+
+    The CLI, the GUI and create_ignore_list.py all write the same store, so
+    the read-modify-write holds a lock on a .lock file next to it.
+    Returns:
+        (MACs, SSIDs, entries skipped as invalid) as written
+    """
+    with open('{}.lock'.format(path), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        known_macs = []
+        known_hashes = []
+        if os.path.exists(path):
+            store = IgnoreStore(path)
+            try:
+                known_macs = [int.from_bytes(record, 'big') for record in store.macs.records]
+                known_hashes = [bytes(record) for record in store.ssids.records]
+            finally:
+                store.close()
+        removed = {parse_mac(mac) for mac in remove_macs}
+        if removed:
+            known_macs = [mac for mac in known_macs if mac not in removed]
+        removed = {ssid_hash(ssid) for ssid in remove_ssids if ssid}
+        if removed:
+            known_hashes = [value for value in known_hashes if value not in removed]
+        return write_store(path, itertools.chain(known_macs, macs), ssids, known_hashes)
+
+
+class StoreWatcher:
+    """Notices when the ignore store is rewritten, with one stat per poll
+
+    Every write goes through os.replace, so a new inode (or mtime/size) means
+    a complete new store is in place; there is never a half-written one to read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def poll(self):
+        """A freshly opened IgnoreStore if the file changed since the last poll, else None"""
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            return IgnoreStore(self.path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+
+def read_py_list(path):
+    """Read a legacy `name = [...]` ignore list without exec()"""
+    with open(path, 'r') as f:
+        source = f.read()
+    if not source.strip():
+        return []
+    tree = ast.parse(source, mode='exec')
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            return list(ast.literal_eval(node.value))
+    return []
+
+
+def convert_py_lists(mac_py, ssid_py, out_path):
+    """One-shot conversion of the legacy .py ignore lists to a binary store"""
+    macs = read_py_list(mac_py) if mac_py and os.path.exists(mac_py) else []
+    ssids = read_py_list(ssid_py) if ssid_py and os.path.exists(ssid_py) else []
+    return write_store(out_path, macs, ssids)
+
+
+def store_path_from_config(config, directory='ignore_lists'):
+    """Path of the ignore store named in config.json"""
+    names = config.get('paths', {}).get('ignore_lists', {})
+    return pathlib.Path(directory) / names.get('store', 'ignore_list.cyti')
+
+
+def open_from_config(config, directory='ignore_lists'):
+    """Open the ignore store named in config.json, converting legacy .py lists once
+
+    Returns:
+        IgnoreStore, or None if there is no store and nothing to convert
+    """
+    names = config['paths']['ignore_lists']
+    directory = pathlib.Path(directory)
+    store_path = store_path_from_config(config, directory)
+    if not store_path.exists():
+        mac_py = directory / names['mac'] if names.get('mac') else None
+        ssid_py = directory / names['ssid'] if names.get('ssid') else None
+        if not any(path and path.exists() for path in (mac_py, ssid_py)):
+            return None
+        convert_py_lists(mac_py, ssid_py, store_path)
+    return IgnoreStore(store_path)
+
+
+def mac_filter_from_config(config, store, directory='ignore_lists'):
+    """MacFilter of the store's MACs and the rules file named in config.json"""
+    rules_name = config['paths']['ignore_lists'].get('rules', 'mac_rules.txt')
+    rules = MacRules.from_file(pathlib.Path(directory) / rules_name)
+    return MacFilter(store.macs if store is not None else frozenset(), rules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert legacy .py ignore lists to the binary CYT ignore store')
+    parser.add_argument('--mac', help='Legacy MAC list (ignore_list = [...])')
+    parser.add_argument('--ssid', help='Legacy probed SSID list (non_alert_ssid_list = [...])')
+    parser.add_argument('-o', '--output', required=True, help='Binary store to write')
+    args = parser.parse_args()
+    mac_count, ssid_count, skipped = convert_py_lists(args.mac, args.ssid, args.output)
+    print('Wrote {} MACs and {} Probed SSIDs to {} ({} invalid entries skipped)'.format(
+        mac_count, ssid_count, args.output, skipped))
+
+
+if __name__ == '__main__':
+    main()
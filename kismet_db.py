@@ -0,0 +1,639 @@
+### Kismet database query layer for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import collections
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from urllib.parse import quote
+
+from mac_address import LOCAL_BIT, parse_mac
+
+### JSON path of the last probed SSID inside a Kismet device record
+PROBED_SSID_PATH = '$."dot11.device"."dot11.device.last_probed_ssid_record"."dot11.probedssid.ssid"'
+
+### Extract the probed SSID inside SQLite so the (often tens of KB) device blob
+### never crosses into Python. instr() is a cheap prefilter equivalent to the old
+### substring check, json_valid() keeps one bad record from failing the query.
+PROBED_SSID_SQL = (
+    "CASE WHEN instr(device, 'dot11.probedssid.ssid') > 0 "
+    "AND json_valid(CAST(device AS TEXT)) "
+    "THEN json_extract(CAST(device AS TEXT), '{}') END".format(PROBED_SSID_PATH)
+)
+
+### Probe fingerprint of a device: every SSID it probed for and the hash Kismet
+### keeps of its probe request IEs. Only locally administered (randomized) MACs,
+### i.e. second hex digit 2, 3, 6, 7, A, B, E or F, are linked, so only they are read.
+PROBED_SSID_MAP_PATH = '$."dot11.device"."dot11.device.probed_ssid_map"'
+PROBE_FINGERPRINT_PATH = '$."dot11.device"."dot11.device.probe_fingerprint"'
+LOCAL_MAC_SQL = "upper(substr(devmac, 2, 1)) IN ('2', '3', '6', '7', 'A', 'B', 'E', 'F')"
+FINGERPRINT_SSIDS_SQL = (
+    "(SELECT json_group_array(json_extract(p.value, '$.\"dot11.probedssid.ssid\"')) "
+    "FROM json_each(CAST(device AS TEXT), '{}') AS p)".format(PROBED_SSID_MAP_PATH)
+)
+FINGERPRINT_IE_SQL = "json_extract(CAST(device AS TEXT), '{}')".format(PROBE_FINGERPRINT_PATH)
+FINGERPRINT_SQL = FINGERPRINT_SSIDS_SQL + ", " + FINGERPRINT_IE_SQL
+HAS_FINGERPRINT_SQL = "{} AND instr(device, 'dot11.device') > 0 AND json_valid(CAST(device AS TEXT))".format(LOCAL_MAC_SQL)
+
+### Schema of the Kismet devices table, for the databases CYT fills itself
+DEVICES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    first_time INT, last_time INT, devkey TEXT, phyname TEXT, devmac TEXT,
+    strongest_signal INT, min_lat REAL, min_lon REAL, max_lat REAL, max_lon REAL,
+    avg_lat REAL, avg_lon REAL, bytes_data INT, type TEXT, device BLOB,
+    UNIQUE(phyname, devmac) ON CONFLICT REPLACE)
+"""
+
+### Sidecar database CYT keeps next to its logs (see DeviceMirror): the fields it
+### reads from each Kismet session, extracted once and indexed by last_time
+MIRROR_TABLE = 'mirror_devices'
+MIRROR_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS mirror_sessions (
+        id INTEGER PRIMARY KEY, path TEXT UNIQUE, last_rowid INT)""",
+    """CREATE TABLE IF NOT EXISTS mirror_devices (
+        session INT, phyname TEXT, mac INT, type TEXT, first_time INT, last_time INT,
+        probed_ssid TEXT, signal INT, probed_ssids TEXT, probe_fingerprint INT, source_rowid INT,
+        PRIMARY KEY (session, phyname, mac))""",
+    "CREATE INDEX IF NOT EXISTS mirror_devices_last_time ON mirror_devices (last_time, source_rowid)",
+]
+MIRROR_COLUMNS = "session, phyname, mac, type, first_time, last_time, probed_ssid, signal, probed_ssids, probe_fingerprint, source_rowid"
+
+### Bytes of device JSON decoded in Python (only the no-JSON1 fallback decodes
+### blobs), exported as a metric
+decoded_bytes = 0
+
+DEFAULT_BUSY_TIMEOUT_MS = 2000
+DEFAULT_BATCH_SIZE = 500  # Rows read per page, so memory is bounded by this rather than the database
+DEFAULT_SIGHTING_CACHE = 20000  # Devices whose type/probed SSID iter_sightings() keeps between batches
+DEFAULT_MAX_SESSIONS = 4
+MAX_ATTACHED = 10  # SQLite's default SQLITE_MAX_ATTACHED
+
+
+def _readonly_uri(path):
+    return 'file:{}?mode=ro'.format(quote(pathlib.Path(path).resolve().as_posix()))
+
+
+def connect_readonly(path, busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS):
+    """Open a Kismet database read-only so we never take a write lock on it
+
+    The URI mode=ro open still reads a WAL-mode database through its -wal/-shm
+    files, so rows Kismet has committed but not checkpointed are visible.
+    """
+    con = sqlite3.connect(_readonly_uri(path), uri=True, timeout=busy_timeout_ms / 1000)
+    con.execute("PRAGMA busy_timeout = {}".format(int(busy_timeout_ms)))
+    con.execute("PRAGMA query_only = ON")
+    return con
+
+
+class KismetReader:
+    """Contention-free reader for a live Kismet database
+
+    Queries normally run against a read-only connection to the live file. With
+    a snapshot_dir (e.g. a tmpfs like /dev/shm) the live file is instead copied
+    with the SQLite backup API on every refresh() and queries run against the
+    copy, so a slow query never holds a lock Kismet's writer is waiting on.
+
+    Earlier (finished) session files passed as history are ATTACHed read-only
+    to the queried connection, so fetch_devices() sees them as one table and
+    detection survives Kismet restarts.
+
+    With a mirror file, refresh() syncs every session into a DeviceMirror and
+    returns its connection instead, so queries never scan Kismet's tables;
+    devices older than retain_seconds are pruned from it. The sync is where
+    the JSON extraction happens then, so a pool (cyt_workers.DecodePool)
+    splits big syncs across its workers.
+    """
+
+    def __init__(self, path, busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS, snapshot_dir=None, history=(),
+                 mirror=None, retain_seconds=None, clock=time, pool=None):
+        self.path = path
+        self.history = list(history)[:MAX_ATTACHED]
+        self.retain_seconds = retain_seconds
+        self.clock = clock
+        self.pool = pool
+        self.mirror = DeviceMirror(mirror) if mirror else None
+        self.live = connect_readonly(path, busy_timeout_ms)
+        self.snapshot_path = None
+        self.snapshot = None
+        if snapshot_dir:
+            self.snapshot_path = pathlib.Path(snapshot_dir) / 'cyt_snapshot_{}'.format(os.path.basename(path))
+            self.snapshot = sqlite3.connect('file:{}'.format(quote(self.snapshot_path.resolve().as_posix())), uri=True)
+            self.refresh()
+        self._attach_history(self.snapshot or self.live)
+
+    @classmethod
+    def from_config(cls, path, config, history=(), **kwargs):
+        """Build a reader from the database section of config.json"""
+        db_config = config.get('database', {})
+        return cls(path,
+                   busy_timeout_ms=db_config.get('busy_timeout_ms', DEFAULT_BUSY_TIMEOUT_MS),
+                   snapshot_dir=db_config.get('snapshot_dir') or None,
+                   history=history, **kwargs)
+
+    def _attach_history(self, con):
+        for i, path in enumerate(self.history, 1):
+            try:
+                con.execute("ATTACH DATABASE ? AS session{}".format(i), (_readonly_uri(path),))
+            except sqlite3.DatabaseError as e:
+                print("Skipping Kismet session {}: {}".format(path, e))
+
+    def refresh(self):
+        """Bring the snapshot and mirror up to date (if any) and return the connection to query"""
+        con = self.live
+        if self.snapshot is not None:
+            self.live.backup(self.snapshot)
+            con = self.snapshot
+        if self.mirror is None:
+            return con
+        since = self.clock.time() - self.retain_seconds if self.retain_seconds else None
+        sessions = [('main', self.path)] + [('session{}'.format(i), path) for i, path in enumerate(self.history, 1)]
+        self.mirror.sync(con, sessions, since, self.pool)
+        if since is not None:
+            self.mirror.prune(since)
+        return self.mirror.con
+
+    def close(self):
+        if self.mirror is not None:
+            self.mirror.close()
+        self.live.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot_path.unlink(missing_ok=True)
+
+
+def device_record(record):
+    """Kismet-shaped device JSON from a simplified device record
+
+    Only the paths this module reads are filled in, so a DeviceTable answers
+    the same queries as a Kismet log.
+    """
+    dot11 = {}
+    if record.get('probed_ssid'):
+        dot11['dot11.device.last_probed_ssid_record'] = {'dot11.probedssid.ssid': record['probed_ssid']}
+    if record.get('probed_ssid_map'):
+        dot11['dot11.device.probed_ssid_map'] = record['probed_ssid_map']
+    if record.get('probe_fingerprint'):
+        dot11['dot11.device.probe_fingerprint'] = record['probe_fingerprint']
+    device = {'kismet.device.base.macaddr': record.get('devmac'),
+              'kismet.device.base.type': record.get('type')}
+    if dot11:
+        device['dot11.device'] = dot11
+    return json.dumps(device)
+
+
+class DeviceTable:
+    """In-memory devices table for sources that are not Kismet logs
+
+    Sources (the Kismet REST API, packet captures) upsert simplified device
+    records, dicts with devmac, phyname, type, first_time, last_time,
+    probed_ssid, probed_ssid_map and probe_fingerprint, and the usual queries
+    run against con.
+    """
+
+    def __init__(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.execute(DEVICES_SCHEMA)
+
+    def upsert(self, records):
+        rows = [(record.get('first_time') or record['last_time'], record['last_time'],
+                 record.get('phyname') or '', record['devmac'], record.get('type'), device_record(record))
+                for record in records if record.get('devmac') and record.get('last_time') is not None]
+        if rows:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO devices (first_time, last_time, phyname, devmac, type, device) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.con.commit()
+        return len(rows)
+
+    def prune(self, before):
+        """Drop devices last seen before a unix time"""
+        self.con.execute("DELETE FROM devices WHERE last_time < ?", (before,))
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+
+class DeviceMirror:
+    """Indexed sidecar copy of the fields CYT reads from Kismet's devices tables
+
+    Kismet's database has no index on last_time and we cannot add one, so every
+    time window query is a scan of a table that grows to GBs over a session.
+    The mirror is CYT's own SQLite file holding one narrow row per device per
+    session (MAC as an integer, type, first/last time, probed SSID, strongest
+    signal and, for randomized MACs, the probe fingerprint) indexed on
+    last_time, and fetch_devices()/fetch_fingerprints() run against it instead.
+
+    Kismet rewrites a device with INSERT OR REPLACE, which gives the new row
+    the next rowid, so sync() only reads rows from the last rowid it saw
+    (inclusive: replacing the newest row can reuse its rowid). The first sync
+    of a session reads the rows since `since`; after that each sync costs the
+    rows Kismet changed, and a query costs the rows in its window, whatever
+    the size of the Kismet file. A session whose rowids went backwards
+    (rewritten in place) is read again from the start.
+
+    Args:
+        path: Sidecar database file (created if missing)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(str(path))
+        self.con.execute("PRAGMA journal_mode = WAL")
+        self.con.execute("PRAGMA synchronous = NORMAL")
+        for statement in MIRROR_SCHEMA:
+            self.con.execute(statement)
+        self.con.commit()
+        self.synced_rows = 0
+        self.newest_rowid = 0
+
+    def _session(self, path):
+        """(id, last rowid read) of a Kismet session file"""
+        row = self.con.execute("SELECT id, last_rowid FROM mirror_sessions WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            cursor = self.con.execute("INSERT INTO mirror_sessions (path, last_rowid) VALUES (?, 0)", (path,))
+            return cursor.lastrowid, 0
+        return row
+
+    def _read(self, pairs):
+        """Mirror rows of (rowid, mirror row) pairs from mirror_rows()
+
+        The newest rowid read is kept in newest_rowid as rows go by, so it is
+        known once the generator is exhausted.
+        """
+        for rowid, row in pairs:
+            self.newest_rowid = max(self.newest_rowid, rowid)
+            if row is not None:
+                self.synced_rows += 1
+                yield row
+
+    def sync(self, con, sessions, since=None, pool=None):
+        """Copy what changed in the attached Kismet sessions into the mirror
+
+        Args:
+            con: Connection to the Kismet database(s)
+            sessions: (schema name on con, Kismet file path) of each session
+            since: On a session's first sync, skip devices last seen before this
+            pool: Optional cyt_workers.DecodePool to split a big sync's rowid
+                range (and so its JSON extraction) across worker processes
+        Returns:
+            Rows copied
+        """
+        synced_before = self.synced_rows
+        schemas = set(device_schemas(con))
+        for schema, path in sessions:
+            if schema not in schemas:
+                continue
+            session, last_rowid = self._session(path)
+            self.newest_rowid = con.execute("SELECT max(rowid) FROM {}.devices".format(schema)).fetchone()[0] or 0
+            if self.newest_rowid < last_rowid:
+                self.con.execute("DELETE FROM mirror_devices WHERE session = ?", (session,))
+                last_rowid = 0
+            session_since = since if last_rowid == 0 else None
+            if pool is None:
+                pairs = mirror_rows(con, schema, session, session_since, (last_rowid, None))
+            else:
+                pairs = pool.mirror_rows(con, schema, session, session_since, last_rowid, self.newest_rowid)
+            self.con.executemany(
+                "INSERT OR REPLACE INTO mirror_devices ({}) VALUES ({})".format(
+                    MIRROR_COLUMNS, ", ".join("?" * len(MIRROR_COLUMNS.split(", ")))),
+                self._read(pairs))
+            self.con.execute("UPDATE mirror_sessions SET last_rowid = ? WHERE id = ?", (self.newest_rowid, session))
+        self.con.commit()
+        return self.synced_rows - synced_before
+
+    def sessions(self):
+        """(id, Kismet file path) of every session in the mirror"""
+        return self.con.execute("SELECT id, path FROM mirror_sessions ORDER BY id").fetchall()
+
+    def iter_session(self, session, start_time=None, end_time=None, batch_size=DEFAULT_BATCH_SIZE):
+        """(mac, type, last_time, probed_ssid) of one session's devices, a page at a time"""
+        where = ["session = ?"]
+        params = [session]
+        if start_time is not None:
+            where.append("last_time >= ?")
+            params.append(start_time)
+        if end_time is not None:
+            where.append("last_time <= ?")
+            params.append(end_time)
+        for row in _keyset(self.con, "mac, type, last_time, probed_ssid", MIRROR_TABLE, where, params,
+                           ('rowid',), batch_size):
+            yield row[1:]
+
+    def prune(self, before):
+        """Drop devices last seen before a unix time"""
+        self.con.execute("DELETE FROM mirror_devices WHERE last_time < ?", (before,))
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+
+def mirror_rows(con, schema, session, since=None, rowid_range=None, batch_size=DEFAULT_BATCH_SIZE):
+    """(rowid, mirror row) of a Kismet devices table, read a page at a time
+
+    The mirror row is None for a device without a usable MAC, so the caller
+    still sees its rowid go by.
+    """
+    where = []
+    params = []
+    _rowid_predicates(rowid_range, where, params)
+    if since is not None:
+        where.append("last_time >= ?")
+        params.append(since)
+    columns = "devmac, phyname, type, first_time, last_time, strongest_signal"
+    use_json = json_supported(con)
+    if use_json:
+        columns += ", {}, CASE WHEN {} THEN {} END, CASE WHEN {} THEN {} END".format(
+            PROBED_SSID_SQL, HAS_FINGERPRINT_SQL, FINGERPRINT_SSIDS_SQL, HAS_FINGERPRINT_SQL, FINGERPRINT_IE_SQL)
+    else:
+        columns += ", device"
+    for row in _keyset(con, columns, "{}.devices".format(schema), where, params, ('rowid',), batch_size):
+        rowid, devmac, phyname, dev_type, first_time, last_time, signal = row[:7]
+        mac = parse_mac(devmac)
+        if mac is None:
+            yield rowid, None
+            continue
+        if use_json:
+            ssid, ssids, ie = row[7:]
+        else:
+            ssid = probed_ssid_from_blob(row[7])
+            ssids, ie = fingerprint_from_blob(row[7]) if mac & LOCAL_BIT else (None, None)
+            if ssids is not None:
+                ssids = json.dumps(ssids)
+        yield rowid, (session, phyname, mac, dev_type, first_time, last_time, ssid, signal, ssids, ie, rowid)
+
+
+def device_schemas(con):
+    """Names of the attached databases (main first) that have a devices table"""
+    schemas = []
+    for seq, name, filename in con.execute("PRAGMA database_list"):
+        if name == 'temp':
+            continue
+        query = "SELECT 1 FROM {}.sqlite_master WHERE type = 'table' AND name = 'devices'".format(name)
+        if con.execute(query).fetchone():
+            schemas.append(name)
+    return schemas
+
+
+def json_supported(con):
+    """True if this SQLite build has the JSON functions"""
+    try:
+        con.execute("SELECT json_extract('{}', '$')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def probed_ssid_from_blob(blob):
+    """Python fallback for SQLite builds without the JSON functions"""
+    global decoded_bytes
+    if isinstance(blob, bytes):
+        blob = str(blob, errors='ignore')
+    if not blob or 'dot11.probedssid.ssid' not in blob:
+        return None
+    try:
+        decoded_bytes += len(blob)
+        device_json = json.loads(blob)
+        return device_json["dot11.device"]["dot11.device.last_probed_ssid_record"]["dot11.probedssid.ssid"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _rowid_predicates(rowid_range, where, params):
+    """Add an optional (first, last) rowid range, either end None for open, to a WHERE clause"""
+    if rowid_range is None:
+        return
+    first, last = rowid_range
+    if first is not None:
+        where.append("rowid >= ?")
+        params.append(first)
+    if last is not None:
+        where.append("rowid <= ?")
+        params.append(last)
+
+
+def _keyset(con, columns, table, where, params, keys, batch_size=DEFAULT_BATCH_SIZE):
+    """Rows of a query read batch_size at a time with keyset pagination
+
+    Each page is its own short statement starting after the keys of the last
+    row of the previous page, so no read transaction stays open on Kismet's
+    database between pages and at most one page is in memory. Rows are yielded
+    with the key columns first.
+    """
+    key_list = ", ".join(keys)
+    after = None
+    while True:
+        clauses = list(where)
+        page_params = list(params)
+        if after is not None:
+            clauses.append("({}) > ({})".format(key_list, ", ".join("?" * len(keys))))
+            page_params.extend(after)
+        query = "SELECT {}, {} FROM {}".format(key_list, columns, table)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY {} LIMIT ?".format(key_list)
+        rows = con.execute(query, page_params + [batch_size]).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][:len(keys)]
+
+
+def iter_devices(con, start_time=None, end_time=None, rowid_range=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Devices last seen in a time range, streamed without loading their device blobs
+
+    Every attached Kismet session is searched, newest (main) first, a page of
+    batch_size rows at a time by rowid, so rows are not in time order.
+    Args:
+        con: Database connection
+        start_time: Optional start time in unix timestamp (inclusive)
+        end_time: Optional end time in unix timestamp (inclusive)
+        rowid_range: Optional (first, last) rowids to read, for splitting one
+            query across worker processes
+        batch_size: Rows read (and device blobs decoded) at a time
+    Yields:
+        (devmac, type, last_time, probed_ssid) tuples (devmac is an integer
+        when con is a DeviceMirror's, which always returns oldest first)
+    """
+    where = []
+    params = []
+    if start_time is not None:
+        where.append("last_time >= ?")
+        params.append(start_time)
+    if end_time is not None:
+        where.append("last_time <= ?")
+        params.append(end_time)
+    if has_table(con, MIRROR_TABLE):
+        for row in _keyset(con, "mac, type, probed_ssid", MIRROR_TABLE, where, params,
+                           ('last_time', 'source_rowid', 'rowid'), batch_size):
+            yield row[3], row[4], row[0], row[5]
+        return
+    _rowid_predicates(rowid_range, where, params)
+
+    use_json = json_supported(con)
+    ssid_column = PROBED_SSID_SQL if use_json else "device"
+    rows = (row[1:] for schema in device_schemas(con)
+            for row in _keyset(con, "devmac, type, last_time, {}".format(ssid_column),
+                               "{}.devices".format(schema), where, params, ('rowid',), batch_size))
+    if use_json:
+        yield from rows
+    else:
+        for row in rows:
+            yield row[0], row[1], row[2], probed_ssid_from_blob(row[3])
+
+
+def fetch_devices(con, start_time=None, end_time=None, rowid_range=None):
+    """iter_devices() as a list
+
+    Returns:
+        List of (devmac, type, last_time, probed_ssid) tuples
+    """
+    return list(iter_devices(con, start_time, end_time, rowid_range))
+
+
+def fingerprint_from_blob(blob):
+    """Python fallback of FINGERPRINT_SQL: (probed SSIDs, probe fingerprint)"""
+    global decoded_bytes
+    if isinstance(blob, bytes):
+        blob = str(blob, errors='ignore')
+    if not blob or 'dot11.device' not in blob:
+        return [], None
+    try:
+        decoded_bytes += len(blob)
+        dot11 = json.loads(blob)["dot11.device"]
+    except (ValueError, KeyError, TypeError):
+        return [], None
+    probed = dot11.get("dot11.device.probed_ssid_map") or []
+    if isinstance(probed, dict):
+        probed = list(probed.values())
+    ssids = [record.get("dot11.probedssid.ssid") for record in probed if isinstance(record, dict)]
+    return ssids, dot11.get("dot11.device.probe_fingerprint")
+
+
+def iter_fingerprints(con, start_time=None, rowid_range=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Probe fingerprints of locally administered MACs last seen since start_time
+
+    Read a page at a time like iter_devices(); rowid_range limits the rows read.
+    Yields:
+        (devmac, probed SSIDs, probe fingerprint) tuples
+    """
+    if has_table(con, MIRROR_TABLE):
+        where = ["probed_ssids IS NOT NULL"]
+        params = []
+        if start_time is not None:
+            where.append("last_time >= ?")
+            params.append(start_time)
+        for row in _keyset(con, "mac, probed_ssids, probe_fingerprint", MIRROR_TABLE, where, params,
+                           ('last_time', 'source_rowid', 'rowid'), batch_size):
+            yield row[3], json.loads(row[4]), row[5]
+        return
+    where = [LOCAL_MAC_SQL, "instr(device, 'dot11.device') > 0"]
+    params = []
+    if start_time is not None:
+        where.append("last_time >= ?")
+        params.append(start_time)
+    _rowid_predicates(rowid_range, where, params)
+
+    use_json = json_supported(con)
+    if use_json:
+        where.append("json_valid(CAST(device AS TEXT))")
+    columns = "devmac, " + (FINGERPRINT_SQL if use_json else "device")
+
+    for schema in device_schemas(con):
+        for row in _keyset(con, columns, "{}.devices".format(schema), where, params, ('rowid',), batch_size):
+            if use_json:
+                yield row[1], json.loads(row[2]), row[3]
+            else:
+                yield (row[1],) + fingerprint_from_blob(row[2])
+
+
+def fetch_fingerprints(con, start_time=None, rowid_range=None):
+    """iter_fingerprints() as a list
+
+    Returns:
+        List of (devmac, probed SSIDs, probe fingerprint) tuples
+    """
+    return list(iter_fingerprints(con, start_time, rowid_range))
+
+
+def has_table(con, name):
+    cursorObj = con.cursor()
+    cursorObj.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursorObj.fetchone() is not None
+
+
+def _device_details(con, macs, phynames, use_json):
+    """{devmac: (type, probed_ssid)} of a batch of devmacs, by the (phyname, devmac) index
+
+    Like iter_devices(), later sessions and rowids win when a devmac is in more than one.
+    """
+    details = {}
+    if not macs:
+        return details
+    ssid_column = PROBED_SSID_SQL if use_json else "device"
+    for schema in device_schemas(con):
+        query = "SELECT devmac, type, {} FROM {}.devices WHERE phyname IN ({}) AND devmac IN ({}) ORDER BY rowid".format(
+            ssid_column, schema, ', '.join('?' * len(phynames[schema])), ', '.join('?' * len(macs)))
+        for devmac, dev_type, ssid in con.execute(query, phynames[schema] + macs):
+            details[devmac] = (dev_type, ssid if use_json else probed_ssid_from_blob(ssid))
+    return details
+
+
+def iter_sightings(con, resolution=60, batch_size=DEFAULT_BATCH_SIZE, cache_size=DEFAULT_SIGHTING_CACHE):
+    """Per-device sightings over a whole (finished) Kismet log, oldest first
+
+    The devices table only keeps first/last time per device, so when Kismet
+    logged packets the timeline is rebuilt from the packets table, grouped in
+    SQL to one sighting per device per resolution seconds (what the live loop
+    would see polling every minute). Without packets, each device's first and
+    last time are used. Type and probed SSID are looked up for batch_size
+    sightings at a time and the last cache_size devices are kept (a device
+    is usually seen again in the next few slots), so memory does not grow
+    with the log.
+    Yields:
+        (timestamp, devmac, type, probed_ssid) tuples sorted by timestamp
+    """
+    use_json = json_supported(con)
+    phynames = {schema: [row[0] for row in con.execute("SELECT DISTINCT phyname FROM {}.devices".format(schema))]
+                for schema in device_schemas(con)}
+
+    cursorObj = con.cursor()
+    if has_table(con, 'packets') and cursorObj.execute("SELECT 1 FROM packets LIMIT 1").fetchone():
+        cursorObj.execute("""
+            SELECT (ts_sec / ?) * ? AS slot, sourcemac
+            FROM packets
+            WHERE sourcemac IS NOT NULL AND sourcemac != '00:00:00:00:00:00'
+            GROUP BY slot, sourcemac
+            ORDER BY slot
+        """, (resolution, resolution))
+    else:
+        cursorObj.execute("""
+            SELECT first_time AS slot, devmac FROM devices
+            UNION
+            SELECT last_time AS slot, devmac FROM devices
+            ORDER BY slot
+        """)
+    devices = collections.OrderedDict()  # devmac -> (type, probed_ssid), least recently seen first
+    while True:
+        rows = cursorObj.fetchmany(batch_size)
+        if not rows:
+            return
+        missing = list({mac for slot, mac in rows if mac not in devices})
+        found = _device_details(con, missing, phynames, use_json)
+        for mac in missing:
+            devices[mac] = found.get(mac, (None, None))
+        for slot, mac in rows:
+            devices.move_to_end(mac)
+            dev_type, probed_ssid = devices[mac]
+            yield slot, mac, dev_type, probed_ssid
+        while len(devices) > cache_size:
+            devices.popitem(last=False)
+
+
+def fetch_sightings(con, resolution=60):
+    """iter_sightings() as a list"""
+    return list(iter_sightings(con, resolution))
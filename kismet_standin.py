@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+### Stand-in Kismet REST server for testing Chasing Your Tail's API source
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import argparse
+import bisect
+import json
+import random
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import kismet_db
+
+LAST_TIME_PATH = re.compile(r'^/devices/last-time/(-?\d+)/devices\.itjson$')
+
+
+def record_from_kismet(path, output):
+    """Write a recording (JSONL of simplified device records) from a finished Kismet log
+
+    Each sighting becomes one record, the way Kismet would report the device
+    as changed at that time.
+    """
+    con = kismet_db.connect_readonly(path)
+    fingerprints = {devmac: (ssids, ie) for devmac, ssids, ie in kismet_db.iter_fingerprints(con)}
+    count = 0
+    with open(output, 'w') as f:
+        for timestamp, devmac, dev_type, probed_ssid in kismet_db.iter_sightings(con):
+            ssids, ie = fingerprints.get(devmac, ([], None))
+            record = {'devmac': devmac, 'phyname': 'IEEE802.11', 'type': dev_type,
+                      'last_time': timestamp, 'probed_ssid': probed_ssid or ''}
+            if ssids:
+                record['probed_ssid_map'] = [{'dot11.probedssid.ssid': ssid} for ssid in ssids]
+            if ie:
+                record['probe_fingerprint'] = ie
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    con.close()
+    return count
+
+
+class Recording:
+    """Recorded device records played back in real time from when the server starts
+
+    Times are shifted so the first record happens at start; a change request
+    gets the newest state of every device changed after since and up to now,
+    like Kismet's /devices/last-time/ endpoint, in no particular order.
+    """
+
+    def __init__(self, path, start=None):
+        with open(path) as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+        self.records.sort(key=lambda record: record['last_time'])
+        first = self.records[0]['last_time'] if self.records else 0
+        self.offset = (start if start is not None else int(time.time())) - first
+        self.times = [record['last_time'] + self.offset for record in self.records]
+
+    def changed(self, since, now):
+        if since < 0:
+            since = now + since  # Negative times are relative, as in Kismet
+        latest = {}
+        for i in range(bisect.bisect_right(self.times, since), bisect.bisect_right(self.times, now)):
+            record = self.records[i]
+            latest[record['devmac']] = dict(record, last_time=self.times[i],
+                                            first_time=record.get('first_time', record['last_time']) + self.offset)
+        # Kismet does not sort these by last_time either
+        records = list(latest.values())
+        random.Random(since).shuffle(records)
+        return records
+
+
+def make_handler(recording, drop_rate, rng):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _serve(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            match = LAST_TIME_PATH.match(self.path.split('?', 1)[0])
+            if not match:
+                self.send_error(404)
+                return
+            records = recording.changed(int(match.group(1)), int(time.time()))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for record in records:
+                if drop_rate and rng.random() < drop_rate:
+                    self.close_connection = True
+                    return  # Simulate Kismet going away mid-response
+                data = (json.dumps(record) + '\n').encode()
+                self.wfile.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded device JSON like Kismet\'s REST API')
+    parser.add_argument('recording', help='JSONL recording to serve (or to write with --record)')
+    parser.add_argument('--record', metavar='KISMET_FILE', help='Write the recording from a finished Kismet log and exit')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2501)
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help='Chance of cutting a response off after each record, to test reconnects')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.record:
+        count = record_from_kismet(args.record, args.recording)
+        print('Recorded {} device changes from {} to {}'.format(count, args.record, args.recording))
+        return
+
+    recording = Recording(args.recording)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(recording, args.drop_rate, random.Random(args.seed)))
+    print('Serving {} device changes on http://{}:{}'.format(len(recording.records), args.host, args.port))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+### Kismet REST API source for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import base64
+import http.client
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from kismet_db import DeviceTable
+
+### Only the fields CYT uses, renamed flat with Kismet's field simplification so
+### each streamed record is a few hundred bytes instead of the full device
+STREAM_FIELDS = [
+    ['kismet.device.base.macaddr', 'devmac'],
+    ['kismet.device.base.phyname', 'phyname'],
+    ['kismet.device.base.type', 'type'],
+    ['kismet.device.base.first_time', 'first_time'],
+    ['kismet.device.base.last_time', 'last_time'],
+    ['dot11.device/dot11.device.last_probed_ssid_record/dot11.probedssid.ssid', 'probed_ssid'],
+    ['dot11.device/dot11.device.probed_ssid_map', 'probed_ssid_map'],
+    ['dot11.device/dot11.device.probe_fingerprint', 'probe_fingerprint'],
+]
+
+DEFAULT_API = {
+    'url': 'http://localhost:2501',
+    'api_key': '',         # Sent as the KISMET cookie
+    'username': '',        # or HTTP basic auth
+    'password': '',
+    'poll_interval': 2,    # Seconds between change requests (and detection cycles)
+    'queue_size': 10000,   # Records buffered before the thread stops asking for more
+    'timeout': 10,
+    'max_backoff': 30,     # Longest wait between reconnect attempts
+}
+
+
+class KismetStreamReader:
+    """Reader fed by Kismet's REST API instead of a log file
+
+    A background thread keeps asking Kismet for the devices changed since the
+    newest last_time it has seen (overlapping by a second, the engine's
+    watermark drops the repeats) and reads the newline-delimited response.
+    Kismet does not sort a response by last_time, so only complete responses
+    are queued: a cycle never sees part of one, moves its watermark past the
+    rest and filters those records out. A response cut off midway is dropped
+    and asked for again. Once queue_size records are waiting the thread holds
+    its next request until refresh() catches up, so a slow cycle never makes
+    memory grow. Failed requests are retried with exponential backoff.
+
+    refresh() moves everything queued into an in-memory kismet_db.DeviceTable and
+    returns it, so it drops in for KismetReader and the rest of the pipeline
+    runs the same queries as against a log file. Rows older than
+    retain_seconds are pruned.
+
+    Args:
+        url: Kismet base URL, e.g. http://localhost:2501
+        since: Unix time to ask for changes from on the first request
+        retain_seconds: How long to keep devices in the table (e.g. the longest window)
+    """
+
+    def __init__(self, url=DEFAULT_API['url'], api_key=None, username=None, password=None,
+                 poll_interval=DEFAULT_API['poll_interval'], queue_size=DEFAULT_API['queue_size'],
+                 timeout=DEFAULT_API['timeout'], max_backoff=DEFAULT_API['max_backoff'],
+                 since=None, retain_seconds=None, clock=time):
+        parts = urlsplit(url)
+        self.url = url
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if api_key:
+            self.headers['Cookie'] = 'KISMET={}'.format(api_key)
+        if username:
+            token = base64.b64encode('{}:{}'.format(username, password or '').encode()).decode()
+            self.headers['Authorization'] = 'Basic {}'.format(token)
+        self.body = urlencode({'json': json.dumps({'fields': STREAM_FIELDS})})
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.retain_seconds = retain_seconds
+        self.clock = clock
+        self.since = int(since if since is not None else clock.time())
+
+        self.queue = queue.Queue()  # One list of records per complete response
+        self.queue_size = queue_size
+        self.queued = 0             # Records waiting in the queue
+        self._room = threading.Condition()
+        self.connected = False
+        self.reconnects = 0
+        self.last_error = None
+        self.table = DeviceTable()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='kismet-stream', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Build a reader from the kismet_api section of config.json"""
+        settings = dict(DEFAULT_API)
+        settings.update(config.get('kismet_api', {}))
+        settings.pop('enabled', None)
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def _connection(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _poll(self, connection):
+        """One change request, queueing its records once the whole response is in"""
+        path = '{}/devices/last-time/{}/devices.itjson'.format(self.base_path, self.since)
+        connection.request('POST', path, body=self.body, headers=self.headers)
+        response = connection.getresponse()
+        if response.status != 200:
+            response.read()
+            raise http.client.HTTPException('HTTP {} from {}'.format(response.status, path))
+        newest = self.since
+        records = []
+        for line in response:
+            if self._stop.is_set():
+                return
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            newest = max(newest, int(record.get('last_time') or 0))
+            records.append(record)
+        with self._room:
+            while self.queued and self.queued + len(records) > self.queue_size:
+                if self._stop.is_set():
+                    return
+                self._room.wait(1)
+            self.queue.put(records)
+            self.queued += len(records)
+        # Kismet's timestamps are whole seconds, so ask again from the newest one
+        self.since = max(self.since, newest - 1)
+
+    def _run(self):
+        connection = None
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if connection is None:
+                    connection = self._connection()
+                self._poll(connection)
+                self.connected = True
+                backoff = 1
+                self._ready.set()
+                wait = self.poll_interval
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self.connected = False
+                self.last_error = str(e)
+                self.reconnects += 1
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                wait = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            self._stop.wait(wait)
+        if connection is not None:
+            connection.close()
+
+    def wait_ready(self, timeout=None):
+        """Wait for the first successful request; False if it did not come in time"""
+        return self._ready.wait(self.timeout if timeout is None else timeout)
+
+    def refresh(self):
+        """Move the queued records into the devices table and return the connection to query"""
+        records = []
+        while True:
+            try:
+                records.extend(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._room:
+            self.queued -= len(records)
+            self._room.notify()
+        self.table.upsert(records)
+        if self.retain_seconds:
+            self.table.prune(self.clock.time() - self.retain_seconds)
+        return self.table.con
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(self.timeout)
+        self.table.close()
@@ -0,0 +1,136 @@
+### Kismet log discovery for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import struct
+
+### inotify constants from <sys/inotify.h>
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _has_magic(path):
+    return any(c in path for c in '*?[')
+
+
+class KismetLogWatcher:
+    """Track the newest Kismet database matching the kismet_logs glob
+
+    On Linux an inotify watch on the log directory reports new files as they
+    are created, so nothing is stat'ed between sessions. Elsewhere (or if the
+    directory part of the pattern is itself a glob) we fall back to polling,
+    and only rescan the directory when its mtime changes.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.directory, self.name_pattern = os.path.split(pattern)
+        self.directory = self.directory or '.'
+        self._fd = None
+        self._dir_mtime = None
+        if not _has_magic(self.directory):
+            self._fd = self._inotify_watch(self.directory)
+            if self._fd is None:
+                self._dir_mtime = os.stat(self.directory).st_mtime_ns
+        self.current = self._newest()
+
+    @staticmethod
+    def _inotify_watch(directory):
+        """Return a non-blocking inotify fd watching directory, or None"""
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            return None
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    @property
+    def mode(self):
+        return 'inotify' if self._fd is not None else 'polling'
+
+    def _newest(self):
+        list_of_files = glob.glob(self.pattern)
+        if not list_of_files:
+            return None
+        return max(list_of_files, key=os.path.getctime)
+
+    def sessions(self, since, limit):
+        """Earlier Kismet databases still written to at or after since, newest first
+
+        Only called when the reader is (re)opened, so the stat per file is paid
+        once per session rather than once per cycle.
+        """
+        found = []
+        for path in glob.glob(self.pattern):
+            if path == self.current:
+                continue
+            try:
+                if os.path.getmtime(path) >= since:
+                    found.append(path)
+            except OSError:
+                continue
+        found.sort(key=os.path.getctime, reverse=True)
+        return found[:limit]
+
+    def _read_events(self):
+        """Names of matching files created since the last call, or None on overflow"""
+        names = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if fnmatch.fnmatch(name, self.name_pattern):
+                    names.append(os.path.join(self.directory, name))
+
+    def poll(self):
+        """Return the path of a newer Kismet database if one appeared, else None"""
+        if self._fd is not None:
+            names = self._read_events()
+            if names == []:
+                return None
+            newest = names[-1] if names else self._newest()
+        else:
+            if not _has_magic(self.directory):
+                try:
+                    mtime = os.stat(self.directory).st_mtime_ns
+                except OSError:
+                    return None
+                if mtime == self._dir_mtime:
+                    return None
+                self._dir_mtime = mtime
+            newest = self._newest()
+        if newest is None or newest == self.current:
+            return None
+        self.current = newest
+        return newest
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,126 @@
+### MAC address handling for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import bisect
+
+MAC_BITS = 48
+MAC_MAX = (1 << MAC_BITS) - 1
+LOCAL_BIT = 0x02 << 40  # Locally administered bit of the first octet (randomized MACs)
+
+
+def mac_to_int(mac):
+    """'AA:BB:CC:DD:EE:FF' (or '-' separated / bare hex) to a 48-bit integer"""
+    digits = mac.strip().replace(':', '').replace('-', '')
+    if len(digits) != 12:
+        raise ValueError('not a MAC address: {!r}'.format(mac))
+    return int(digits, 16)
+
+
+def parse_mac(mac):
+    """mac_to_int(), or None for anything that is not a MAC address (integers pass through)"""
+    if isinstance(mac, int):
+        return mac
+    try:
+        return mac_to_int(mac)
+    except (ValueError, AttributeError):
+        return None
+
+
+def int_to_mac(value):
+    """48-bit integer to 'AA:BB:CC:DD:EE:FF'"""
+    return ':'.join('{:02X}'.format((value >> shift) & 0xFF) for shift in range(40, -8, -8))
+
+
+def is_locally_administered(mac):
+    return bool(mac & LOCAL_BIT)
+
+
+def _octets(text):
+    """Hex octets of a (possibly partial) MAC as (value, bit count)"""
+    parts = text.replace('-', ':').split(':')
+    if not 1 <= len(parts) <= 6 or not all(1 <= len(p) <= 2 for p in parts):
+        raise ValueError('not a MAC prefix: {!r}'.format(text))
+    value = 0
+    for part in parts:
+        value = (value << 8) | int(part, 16)
+    return value << (8 * (6 - len(parts))), 8 * len(parts)
+
+
+class MacRules:
+    """Ignore rules covering ranges of MACs rather than single addresses
+
+    One rule per line:
+        00:1A:2B                                  OUI (or any 1-6 octet prefix)
+        00:1A:2B:30:00:00/28                      prefix of the given length in bits
+        00:1A:2B:00:00:00&FF:FF:FF:00:00:F0       value and mask
+        local                                     locally administered (randomized) MACs
+
+    Prefix rules are merged into sorted, non-overlapping ranges checked with a
+    binary search; masks that are not a prefix are checked one by one, which is
+    fine for the handful a rules file holds.
+    """
+
+    def __init__(self, rules=()):
+        ranges = []
+        self.masks = []  # (mask, value) pairs
+        for rule in rules:
+            kind, first, second = self.parse(rule)
+            if kind == 'range':
+                ranges.append((first, second))
+            else:
+                self.masks.append((first, second))
+
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @staticmethod
+    def parse(rule):
+        """('range', first, last) or ('mask', mask, value) for one rule"""
+        rule = rule.strip()
+        if rule.lower() == 'local':
+            return 'mask', LOCAL_BIT, LOCAL_BIT
+        if '&' in rule:
+            value, mask = (mac_to_int(part) for part in rule.split('&', 1))
+            free = ~mask & MAC_MAX
+            if free & (free + 1) == 0:  # Mask is a prefix, so it is a plain range
+                return 'range', value & mask, (value & mask) | free
+            return 'mask', mask, value & mask
+        if '/' in rule:
+            address, length = rule.split('/', 1)
+            value, _ = _octets(address)
+            bits = int(length)
+        else:
+            value, bits = _octets(rule)
+        if not 0 <= bits <= MAC_BITS:
+            raise ValueError('bad prefix length in rule: {!r}'.format(rule))
+        free = (1 << (MAC_BITS - bits)) - 1
+        return 'range', value & ~free, (value & ~free) | free
+
+    @classmethod
+    def from_file(cls, path):
+        """Rules from a text file ('#' starts a comment), or no rules if it is missing"""
+        try:
+            with open(path, 'r') as f:
+                lines = [line.split('#', 1)[0].strip() for line in f]
+        except FileNotFoundError:
+            return cls()
+        return cls(line for line in lines if line)
+
+    def __len__(self):
+        return len(self.starts) + len(self.masks)
+
+    def __contains__(self, mac):
+        i = bisect.bisect_right(self.starts, mac) - 1
+        if i >= 0 and mac <= self.ends[i]:
+            return True
+        for mask, value in self.masks:
+            if mac & mask == value:
+                return True
+        return False
@@ -0,0 +1,177 @@
+### Randomized MAC linking for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import hashlib
+import random
+
+from mac_address import LOCAL_BIT, MAC_BITS, int_to_mac
+
+IDENTITY_BIT = 1 << MAC_BITS  # Marks a linked identity key, so it never collides with a MAC
+MERSENNE_PRIME = (1 << 61) - 1
+
+DEFAULT_LINKING = {
+    'enabled': False,    # Opt in: adds a fingerprint query and MinHash work to every cycle
+    'num_perm': 32,      # MinHash signature length
+    'bands': 16,         # LSH bands (num_perm / bands rows each)
+    'threshold': 0.5,    # Jaccard similarity needed to link two MACs
+    'min_features': 2,   # Fingerprints smaller than this are too common to link on
+}
+
+
+def fingerprint(ssids, ie_fingerprint=None):
+    """Feature set of a device: the SSIDs it probed for and its probe IE fingerprint"""
+    features = {'ssid:' + ssid for ssid in ssids if ssid}
+    if ie_fingerprint:
+        features.add('ie:{}'.format(ie_fingerprint))
+    return features
+
+
+def identity_mac(label):
+    """MAC a linked identity key was named after"""
+    return label & ~IDENTITY_BIT
+
+
+class MacLinker:
+    """Groups randomized MACs that are likely the same device
+
+    Each locally administered MAC gets a MinHash signature of its fingerprint,
+    split into LSH bands; MACs sharing any band are candidates, and candidates
+    whose exact Jaccard similarity reaches the threshold are merged into one
+    identity. Work per update is the size of the band buckets it lands in, not
+    the number of devices seen.
+
+    Every fingerprinted MAC has an identity key (IDENTITY_BIT | MAC), so
+    presence can be tracked per identity before it is linked to anything. When
+    two identities merge the key of the larger one survives (the smaller key on
+    a tie), so a long-lived identity keeps its name as new MACs join it and the
+    result does not depend on dict order; update() reports the (old, new) renames so callers can carry
+    history over.
+
+    Args:
+        num_perm: MinHash signature length
+        bands: Number of LSH bands
+        threshold: Minimum Jaccard similarity to link two MACs
+        min_features: Minimum fingerprint size to take part in linking
+        seed: Seed of the MinHash permutations
+    """
+
+    def __init__(self, num_perm=DEFAULT_LINKING['num_perm'], bands=DEFAULT_LINKING['bands'],
+                 threshold=DEFAULT_LINKING['threshold'], min_features=DEFAULT_LINKING['min_features'],
+                 seed=1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.min_features = min_features
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+
+        self._features = {}   # MAC -> feature set
+        self._bands = {}      # MAC -> band keys it is filed under
+        self._buckets = {}    # band key -> set of MACs
+        self._label = {}      # MAC -> identity key
+        self._members = {}    # identity key -> set of MACs
+        self._last_seen = {}  # MAC -> last sighting time
+
+    @classmethod
+    def from_config(cls, config):
+        """A linker from the linking section of config.json, or None if linking is off"""
+        settings = dict(DEFAULT_LINKING)
+        settings.update(config.get('linking', {}))
+        if not settings.pop('enabled'):
+            return None
+        return cls(**settings)
+
+    def signature(self, features):
+        hashes = [int.from_bytes(hashlib.blake2b(f.encode('utf-8', errors='surrogateescape'),
+                                                 digest_size=8).digest(), 'little')
+                  for f in features]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, features):
+        signature = self.signature(features)
+        return [(band,) + tuple(signature[band * self.rows:(band + 1) * self.rows])
+                for band in range(self.bands)]
+
+    def update(self, mac, features, ts):
+        """Add a sighting of a MAC with (part of) its fingerprint
+
+        Returns:
+            (identity key or None, list of (old key, new key) merges)
+        """
+        if not mac & LOCAL_BIT:
+            return None, []
+        known = self._features.get(mac)
+        if known is None and not features:
+            return None, []
+        self._last_seen[mac] = ts
+        if known is None:
+            known = self._features[mac] = set()
+            # A returning MAC rejoins the identity still named after it
+            self._label[mac] = IDENTITY_BIT | mac
+            self._members.setdefault(IDENTITY_BIT | mac, set()).add(mac)
+        if features <= known:
+            return self._label[mac], []
+        known |= features
+        if len(known) < self.min_features:
+            return self._label[mac], []
+
+        for key in self._bands.get(mac, ()):
+            self._buckets[key].discard(mac)
+            if not self._buckets[key]:
+                del self._buckets[key]
+        keys = self._band_keys(known)
+        self._bands[mac] = keys
+        candidates = set()
+        for key in keys:
+            bucket = self._buckets.setdefault(key, set())
+            candidates |= bucket
+            bucket.add(mac)
+
+        merges = []
+        for other in sorted(candidates):
+            if self._label[other] == self._label[mac]:
+                continue
+            theirs = self._features[other]
+            if len(known & theirs) / len(known | theirs) >= self.threshold:
+                merges.append(self._merge(self._label[mac], self._label[other]))
+        return self._label[mac], merges
+
+    def _merge(self, a, b):
+        keep, drop = sorted((a, b), key=lambda label: (-len(self._members[label]), label))
+        for member in self._members.pop(drop):
+            self._label[member] = keep
+            self._members[keep].add(member)
+        return drop, keep
+
+    def label(self, mac):
+        return self._label.get(mac)
+
+    def members(self, label):
+        return self._members.get(label, set())
+
+    def describe(self, label):
+        """'AA:BB:CC:DD:EE:FF +2 linked MACs' for a linked identity"""
+        return '{} +{} linked MACs'.format(int_to_mac(identity_mac(label)), len(self.members(label)) - 1)
+
+    def linked_count(self):
+        """Identities made of more than one MAC"""
+        return sum(1 for members in self._members.values() if len(members) > 1)
+
+    def expire(self, before):
+        """Forget MACs not seen since before, keeping the key of identities that live on"""
+        for mac in [m for m, ts in self._last_seen.items() if ts < before]:
+            del self._last_seen[mac]
+            del self._features[mac]
+            for key in self._bands.pop(mac, ()):
+                self._buckets[key].discard(mac)
+                if not self._buckets[key]:
+                    del self._buckets[key]
+            label = self._label.pop(mac)
+            members = self._members[label]
+            members.discard(mac)
+            if not members:
+                del self._members[label]
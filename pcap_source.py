@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+### pcap/pcapng probe request source for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import argparse
+import os
+import struct
+import time
+import zlib
+
+from kismet_db import DeviceTable
+from mac_address import LOCAL_BIT, int_to_mac
+
+CAPTURE_SUFFIXES = ('.pcap', '.pcapng', '.cap')
+
+### pcap magic -> timestamp units; read little endian, a big endian file shows up byte swapped
+PCAP_MAGIC = {0xa1b2c3d4: 1e-6, 0xa1b23c4d: 1e-9}
+PCAP_MAGIC_SWAPPED = {0xd4c3b2a1: 1e-6, 0x4d3cb2a1: 1e-9}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+PCAPNG_IF_TSRESOL = 9
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_RADIOTAP = 127
+
+RADIOTAP_TSFT = 0x1
+RADIOTAP_FLAGS = 0x2
+RADIOTAP_EXT = 0x80000000
+RADIOTAP_F_FCS = 0x10
+
+PROBE_REQUEST = 0x40  # First frame control byte: management type, probe request subtype
+IE_SSID = 0
+### IEs describing the radio rather than the network it wants, hashed into the
+### probe fingerprint: rates, HT caps, extended rates, extended caps, VHT caps, vendor
+FINGERPRINT_TAGS = frozenset((1, 45, 50, 127, 191, 221))
+DEVICE_TYPE = 'Wi-Fi Client'
+
+### Per-device state, kept in a list updated in place so a frame allocates nothing new
+FIRST, LAST, SSID, SSID_RAW, SSIDS, FINGERPRINT, DIRTY, SLOT, SIGHTING = range(9)
+
+
+class ProbeParser:
+    """Incremental pcap/pcapng parser for 802.11 probe requests
+
+    feed() takes capture bytes as they arrive (a whole file or a growing one),
+    walks the records with struct.unpack_from over one memoryview of the
+    buffer and keeps each transmitter's probe state: first and last time, the
+    SSIDs it probed for and a CRC32 fingerprint of its capability IEs. Any
+    partial record at the end is kept for the next feed(). Frames are plain
+    802.11 or radiotap (a trailing FCS is skipped); other link types are
+    counted and ignored.
+
+    Args:
+        resolution: With sightings=True, seconds per (time slot, MAC) sighting
+        sightings: Also keep the sightings timeline, for offline replays
+    """
+
+    def __init__(self, resolution=60, sightings=False):
+        self.resolution = resolution
+        self.sightings = [] if sightings else None
+        self.devices = {}  # MAC -> state list (see FIRST ... SIGHTING)
+        self.frames = 0
+        self.probes = 0
+        self._buffer = b''
+        self._format = None
+        self._endian = '<'
+        self._pcap_record = struct.Struct('<IIII')
+        self._linktype = None
+        self._scale = 1e-6
+        self._interfaces = []  # pcapng: (linktype, timestamp scale) per interface
+
+    def feed(self, data):
+        """Parse as much of the buffered capture as is complete"""
+        buffer = self._buffer + data if self._buffer else data
+        view = memoryview(buffer)
+        if self._format is None:
+            if len(view) < 24:
+                self._buffer = bytes(buffer)
+                return
+            offset = self._read_file_header(view)
+        else:
+            offset = 0
+        if self._format == 'pcap':
+            offset = self._feed_pcap(view, offset)
+        else:
+            offset = self._feed_pcapng(view, offset)
+        self._buffer = bytes(view[offset:])
+
+    def _read_file_header(self, view):
+        (magic,) = struct.unpack_from('<I', view, 0)
+        if magic == PCAPNG_SHB:
+            self._format = 'pcapng'
+            return 0
+        if magic in PCAP_MAGIC:
+            self._endian, self._scale = '<', PCAP_MAGIC[magic]
+        elif magic in PCAP_MAGIC_SWAPPED:
+            self._endian, self._scale = '>', PCAP_MAGIC_SWAPPED[magic]
+        else:
+            raise ValueError('not a pcap or pcapng capture')
+        self._format = 'pcap'
+        self._pcap_record = struct.Struct(self._endian + 'IIII')
+        (self._linktype,) = struct.unpack_from(self._endian + 'I', view, 20)
+        return 24
+
+    def _feed_pcap(self, view, offset):
+        record = self._pcap_record
+        end_of_data = len(view)
+        while offset + 16 <= end_of_data:
+            ts_sec, ts_frac, captured, original = record.unpack_from(view, offset)
+            end = offset + 16 + captured
+            if end > end_of_data:
+                break
+            self._frame(view, offset + 16, end, self._linktype, ts_sec + ts_frac * self._scale)
+            offset = end
+        return offset
+
+    def _feed_pcapng(self, view, offset):
+        end_of_data = len(view)
+        while offset + 12 <= end_of_data:
+            (block_type,) = struct.unpack_from(self._endian + 'I', view, offset)
+            if block_type == PCAPNG_SHB:
+                (byte_order,) = struct.unpack_from('<I', view, offset + 8)
+                self._endian = '<' if byte_order == PCAPNG_BYTE_ORDER else '>'
+                self._interfaces = []
+            (block_length,) = struct.unpack_from(self._endian + 'I', view, offset + 4)
+            if block_length < 12:
+                raise ValueError('corrupt pcapng block at offset {}'.format(offset))
+            if offset + block_length > end_of_data:
+                break
+            if block_type == PCAPNG_IDB:
+                self._interfaces.append(self._read_interface(view, offset, block_length))
+            elif block_type == PCAPNG_EPB:
+                interface, ts_high, ts_low, captured, original = \
+                    struct.unpack_from(self._endian + 'IIIII', view, offset + 8)
+                if interface < len(self._interfaces):
+                    linktype, scale = self._interfaces[interface]
+                    start = offset + 28
+                    self._frame(view, start, start + captured, linktype, ((ts_high << 32) | ts_low) * scale)
+            offset += block_length
+        return offset
+
+    def _read_interface(self, view, offset, block_length):
+        (linktype,) = struct.unpack_from(self._endian + 'H', view, offset + 8)
+        scale = 1e-6
+        position = offset + 16
+        end = offset + block_length - 4
+        while position + 4 <= end:
+            code, length = struct.unpack_from(self._endian + 'HH', view, position)
+            if code == 0:
+                break
+            if code == PCAPNG_IF_TSRESOL and length >= 1:
+                resolution = view[position + 4]
+                scale = 2.0 ** -(resolution & 0x7F) if resolution & 0x80 else 10.0 ** -resolution
+            position += 4 + (length + 3) // 4 * 4
+        return linktype, scale
+
+    def _frame(self, view, start, end, linktype, ts):
+        self.frames += 1
+        if linktype == LINKTYPE_RADIOTAP:
+            if end - start < 8:
+                return
+            radiotap_length, present = struct.unpack_from('<HI', view, start + 2)
+            if present & RADIOTAP_FLAGS:
+                position = start + 8
+                extended = present
+                while extended & RADIOTAP_EXT and position + 4 <= end:
+                    (extended,) = struct.unpack_from('<I', view, position)
+                    position += 4
+                if present & RADIOTAP_TSFT:
+                    position = start + (position - start + 7) // 8 * 8 + 8
+                if position < start + radiotap_length and view[position] & RADIOTAP_F_FCS:
+                    end -= 4
+            start += radiotap_length
+        elif linktype != LINKTYPE_IEEE802_11:
+            return
+        if end - start < 24 or view[start] & 0xFC != PROBE_REQUEST:
+            return
+        self.probes += 1
+        high, low = struct.unpack_from('>HI', view, start + 10)
+        mac = (high << 32) | low
+
+        # Walk the IEs: remember where the SSID is, fold the capability IEs into the fingerprint
+        ssid_start = ssid_end = 0
+        fingerprint = 0
+        position = start + 24
+        while position + 2 <= end:
+            tag = view[position]
+            body = position + 2
+            tag_end = body + view[position + 1]
+            if tag_end > end:
+                break
+            if tag == IE_SSID:
+                ssid_start, ssid_end = body, tag_end
+            elif tag in FINGERPRINT_TAGS:
+                fingerprint = zlib.crc32(view[position:tag_end], fingerprint)
+            position = tag_end
+
+        state = self.devices.get(mac)
+        if state is None:
+            state = self.devices[mac] = [ts, ts, None, b'', None, fingerprint, True, None, None]
+        else:
+            state[LAST] = ts
+            state[DIRTY] = True
+            if fingerprint:
+                state[FINGERPRINT] = fingerprint
+        if ssid_end > ssid_start and view[ssid_start:ssid_end] != state[SSID_RAW]:
+            raw = bytes(view[ssid_start:ssid_end])
+            state[SSID_RAW] = raw
+            state[SSID] = raw.decode('utf-8', errors='replace')
+            if state[SSIDS] is None:
+                state[SSIDS] = set()
+            state[SSIDS].add(state[SSID])
+
+        if self.sightings is not None:
+            slot = int(ts) // self.resolution * self.resolution
+            if slot != state[SLOT]:
+                state[SLOT] = slot
+                state[SIGHTING] = len(self.sightings)
+                self.sightings.append([slot, mac, state[SSID]])
+            else:
+                self.sightings[state[SIGHTING]][2] = state[SSID]
+
+    def _record(self, mac, state):
+        """Simplified device record (see kismet_db.DeviceTable) of one device"""
+        record = {'devmac': int_to_mac(mac), 'phyname': 'IEEE802.11', 'type': DEVICE_TYPE,
+                  'first_time': int(state[FIRST]), 'last_time': int(state[LAST]),
+                  'probed_ssid': state[SSID] or ''}
+        if state[SSIDS]:
+            record['probed_ssid_map'] = [{'dot11.probedssid.ssid': ssid} for ssid in sorted(state[SSIDS])]
+        if state[FINGERPRINT]:
+            record['probe_fingerprint'] = state[FINGERPRINT]
+        return record
+
+    def changed_records(self):
+        """Records of the devices heard since the last call"""
+        records = []
+        for mac, state in self.devices.items():
+            if state[DIRTY]:
+                state[DIRTY] = False
+                records.append(self._record(mac, state))
+        return records
+
+    def expire(self, before):
+        """Forget devices last heard before a unix time"""
+        for mac in [m for m, state in self.devices.items() if state[LAST] < before]:
+            del self.devices[mac]
+
+
+class PcapReader:
+    """Reader that follows a (possibly still growing) pcap/pcapng capture
+
+    Every refresh() parses the bytes written since the last one and upserts
+    the devices heard into an in-memory kismet_db.DeviceTable, so it drops in
+    for KismetReader. A capture that shrinks (rewritten in place) is read
+    again from the start.
+
+    Args:
+        path: Capture file, e.g. from tcpdump -w or dumpcap -w
+        retain_seconds: How long to keep devices (e.g. the longest window)
+    """
+
+    def __init__(self, path, retain_seconds=None, clock=time, chunk_size=1 << 20):
+        self.path = path
+        self.retain_seconds = retain_seconds
+        self.clock = clock
+        self.chunk_size = chunk_size
+        self.table = DeviceTable()
+        self._open()
+
+    def _open(self):
+        self.parser = ProbeParser()
+        self._file = open(self.path, 'rb')
+        self._position = 0
+
+    def refresh(self):
+        """Parse what was captured since the last call and return the connection to query"""
+        try:
+            if os.stat(self.path).st_size < self._position:
+                self._file.close()
+                self._open()
+        except OSError:
+            pass
+        while True:
+            data = self._file.read(self.chunk_size)
+            if not data:
+                break
+            self._position += len(data)
+            self.parser.feed(data)
+        self.table.upsert(self.parser.changed_records())
+        if self.retain_seconds:
+            before = self.clock.time() - self.retain_seconds
+            self.parser.expire(before)
+            self.table.prune(before)
+        return self.table.con
+
+    def close(self):
+        self._file.close()
+        self.table.close()
+
+
+def read_capture(path, resolution=60):
+    """Sightings and fingerprints of a finished capture, shaped like the Kismet readers'
+
+    Returns:
+        (list of (timestamp, devmac, type, probed_ssid) sorted like
+        kismet_db.fetch_sightings(), with probed_ssid None when there was
+        none, so merge it with other sources by timestamp only; list of (devmac, probed SSIDs, probe
+        fingerprint) for locally administered MACs like kismet_db.fetch_fingerprints())
+    """
+    parser = ProbeParser(resolution, sightings=True)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            parser.feed(data)
+    # Sorted on (slot, devmac) only: probed_ssid is None for devices that never sent an SSID
+    sightings = sorted(((slot, int_to_mac(mac), DEVICE_TYPE, ssid) for slot, mac, ssid in parser.sightings),
+                       key=lambda sighting: sighting[:2])
+    fingerprints = [(int_to_mac(mac), sorted(state[SSIDS] or ()), state[FINGERPRINT] or None)
+                    for mac, state in parser.devices.items() if mac & LOCAL_BIT]
+    return sightings, fingerprints
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count probe requests and devices in pcap/pcapng captures')
+    parser.add_argument('captures', nargs='+')
+    args = parser.parse_args()
+    for path in args.captures:
+        probe_parser = ProbeParser()
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(1 << 20)
+                if not data:
+                    break
+                probe_parser.feed(data)
+        elapsed = time.perf_counter() - started
+        print('{}: {} frames, {} probe requests from {} devices in {:.2f}s ({:.0f} frames/s)'.format(
+            path, probe_parser.frames, probe_parser.probes, len(probe_parser.devices), elapsed,
+            probe_parser.frames / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
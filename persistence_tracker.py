@@ -0,0 +1,293 @@
+### Persistence tracking for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from functools import reduce
+from math import gcd
+
+LEVELS = ('ALERT', 'WARNING', 'CRITICAL')
+
+### Checkpoint layout (zlib compressed after the header):
+###   header:  magic, version, bucket_seconds, tracker time, watermark_time, window count
+###   body:    windows (u16 each), SSID table, watermark MACs, buckets
+### MACs are stored as 64-bit integers; SSIDs are stored once in the table and
+### referenced by index everywhere else. Every entry carries the first and last
+### time it was seen within its bucket.
+CHECKPOINT_MAGIC = b'CYTK'
+CHECKPOINT_VERSION = 3
+CHECKPOINT_HEADER = struct.Struct('<4sBIddH')
+
+
+DEFAULT_WINDOWS = {'recent': 5, 'medium': 10, 'old': 15, 'oldest': 20}
+
+
+def config_windows(config):
+    """Window boundaries in minutes from the timing.time_windows section of config.json"""
+    return list((config.get('timing', {}).get('time_windows') or DEFAULT_WINDOWS).values())
+
+
+class PersistenceTracker:
+    """Time-bucketed presence of MACs and probed SSIDs
+
+    Observations are dropped into fixed-width buckets (the gcd of the window
+    boundaries) keyed by absolute bucket number, so expiring old sightings is
+    just dropping the oldest bucket. Each entry keeps the first and last time it
+    was seen within its bucket, and windows are picked from the time elapsed
+    since those sightings, so a device seen 20 seconds apart on either side of a
+    bucket boundary is still in the current window. Since a bucket is never
+    wider than a window, its first and last sighting cover every window it
+    touches. MACs are 48-bit integers (see mac_address.mac_to_int).
+
+    Args:
+        windows: Window boundaries in minutes, e.g. [5, 10, 15, 20]. Window 0 is
+            the current window, window k covers windows[k-1] to windows[k] ago.
+        now: Unix timestamp the tracker starts at
+    """
+
+    def __init__(self, windows, now):
+        self.windows = sorted(int(w) for w in windows)
+        if not self.windows or self.windows[0] <= 0:
+            raise ValueError('time windows must be positive minutes')
+        self.bucket_seconds = reduce(gcd, self.windows) * 60
+        self.max_window_seconds = self.windows[-1] * 60
+        self._bounds = [w * 60 for w in self.windows]
+
+        self._macs = {}   # bucket number -> {MAC: [first seen, last seen]}
+        self._ssids = {}  # bucket number -> {probed SSID: [first seen, last seen]}
+        self.now = now
+        self.current_bucket = self._bucket(now)
+
+    @classmethod
+    def from_config(cls, config, now):
+        """Build a tracker from the timing.time_windows section of config.json"""
+        return cls(config_windows(config), now)
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def _window(self, elapsed):
+        """Window index for a sighting elapsed seconds ago, or None past the oldest window"""
+        k = bisect_right(self._bounds, elapsed)
+        return k if k < len(self.windows) else None
+
+    def advance(self, now):
+        """Move the tracker clock forward, expiring buckets past the oldest window
+
+        Returns True when a new bucket was started (i.e. the windows rotated).
+        """
+        self.now = max(self.now, now)
+        bucket = self._bucket(now)
+        if bucket <= self.current_bucket:
+            return False
+        self.current_bucket = bucket
+        oldest = self._bucket(self.now - self.max_window_seconds)
+        for store in (self._macs, self._ssids):
+            for expired in [b for b in store if b < oldest]:
+                del store[expired]
+        return True
+
+    @staticmethod
+    def _record(store, bucket, value, timestamp):
+        entries = store.setdefault(bucket, {})
+        span = entries.get(value)
+        if span is None:
+            entries[value] = [timestamp, timestamp]
+        elif timestamp < span[0]:
+            span[0] = timestamp
+        elif timestamp > span[1]:
+            span[1] = timestamp
+
+    def observe(self, mac, timestamp, ssid=None):
+        """Record a sighting of a MAC (and optionally the SSID it probed for)"""
+        if timestamp <= self.now - self.max_window_seconds:
+            return
+        bucket = min(self._bucket(timestamp), self.current_bucket)
+        if mac is not None:
+            self._record(self._macs, bucket, mac, timestamp)
+        if ssid:
+            self._record(self._ssids, bucket, ssid, timestamp)
+
+    def relabel(self, old, new):
+        """Move every sighting of one key to another, e.g. when two linked identities merge"""
+        for entries in self._macs.values():
+            span = entries.pop(old, None)
+            if span is None:
+                continue
+            merged = entries.get(new)
+            if merged is None:
+                entries[new] = span
+            else:
+                merged[0] = min(merged[0], span[0])
+                merged[1] = max(merged[1], span[1])
+
+    def forget(self, mac_ignored, ssid_ignored):
+        """Drop every MAC/SSID the predicates match, e.g. ones just added to the ignore list
+
+        Returns:
+            (MACs, SSIDs) dropped
+        """
+        dropped = []
+        for store, ignored in ((self._macs, mac_ignored), (self._ssids, ssid_ignored)):
+            gone = set()
+            for entries in store.values():
+                matched = [value for value in entries if value in gone or ignored(value)]
+                for value in matched:
+                    del entries[value]
+                gone.update(matched)
+            dropped.append(len(gone))
+        return tuple(dropped)
+
+    def _windows_of(self, store, value, now):
+        seen = set()
+        for entries in store.values():
+            span = entries.get(value)
+            if span is not None:
+                for timestamp in span:
+                    seen.add(self._window(now - timestamp))
+        return seen
+
+    def seen_in_window(self, mac, k, now=None):
+        """True if the MAC was seen in window k (measured back from now, default the tracker clock)"""
+        return k in self._windows_of(self._macs, mac, self.now if now is None else now)
+
+    def windows_seen(self, mac, now=None):
+        """Indexes of the past windows (k >= 1) the MAC was seen in
+
+        Args:
+            now: Time the windows are measured back from, e.g. the time of the
+                sighting being checked (default the tracker clock)
+        """
+        seen = self._windows_of(self._macs, mac, self.now if now is None else now)
+        return sorted(k for k in seen if k)
+
+    def window_label(self, k):
+        """Human readable span of window k, e.g. '5-10'"""
+        start = self.windows[k - 1] if k else 0
+        return '{}-{}'.format(start, self.windows[k])
+
+    def level(self, k):
+        """Alert level for a device seen again from window k"""
+        return LEVELS[min(k, len(LEVELS)) - 1]
+
+    def _members(self, store, k):
+        members = set()
+        for entries in store.values():
+            for value, (first, last) in entries.items():
+                if self._window(self.now - first) == k or self._window(self.now - last) == k:
+                    members.add(value)
+        return members
+
+    def macs_in_window(self, k):
+        return self._members(self._macs, k)
+
+    def ssids_in_window(self, k):
+        return self._members(self._ssids, k)
+
+    def entry_counts(self):
+        """Total (MAC, SSID) entries held across all buckets, without copying them"""
+        return (sum(len(b) for b in self._macs.values()),
+                sum(len(b) for b in self._ssids.values()))
+
+    def window_sizes(self):
+        """(label, MAC count, SSID count) for every window, newest first"""
+        return [(self.window_label(k), len(self.macs_in_window(k)), len(self.ssids_in_window(k)))
+                for k in range(len(self.windows))]
+
+    def save(self, path, watermark_time, watermark_macs):
+        """Atomically write a compact binary checkpoint of the tracker and poll watermark"""
+        strings = {}
+
+        def index(value):
+            return strings.setdefault(value, len(strings))
+
+        buckets = []
+        for bucket in sorted(set(self._macs) | set(self._ssids)):
+            macs = self._macs.get(bucket, {})
+            ssids = self._ssids.get(bucket, {})
+            spans = [t for span in macs.values() for t in span] + [t for span in ssids.values() for t in span]
+            buckets.append((bucket, list(macs), [index(s) for s in ssids], spans))
+        watermark = list(watermark_macs)
+
+        body = [struct.pack('<{}H'.format(len(self.windows)), *self.windows)]
+        body.append(struct.pack('<I', len(strings)))
+        for value in strings:
+            encoded = value.encode('utf-8', errors='surrogateescape')
+            body.append(struct.pack('<H', len(encoded)))
+            body.append(encoded)
+        body.append(struct.pack('<I{}Q'.format(len(watermark)), len(watermark), *watermark))
+        body.append(struct.pack('<I', len(buckets)))
+        for bucket, macs, ssids, spans in buckets:
+            body.append(struct.pack('<qII', bucket, len(macs), len(ssids)))
+            body.append(struct.pack('<{}Q{}I{}d'.format(len(macs), len(ssids), len(spans)), *macs, *ssids, *spans))
+
+        header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, self.bucket_seconds,
+                                        self.now, watermark_time, len(self.windows))
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(zlib.compress(b''.join(body)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, windows):
+        """Load a checkpoint written by save() for the same time windows
+
+        Returns:
+            (tracker, watermark_time, watermark_macs), or None if there is no
+            usable checkpoint (missing, corrupt, or made with other windows)
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, bucket_seconds, now, watermark_time, window_count = \
+                CHECKPOINT_HEADER.unpack_from(data)
+            if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+                return None
+            body = memoryview(zlib.decompress(data[CHECKPOINT_HEADER.size:]))
+
+            offset = 0
+            saved_windows = list(struct.unpack_from('<{}H'.format(window_count), body, offset))
+            offset += 2 * window_count
+            if saved_windows != sorted(int(w) for w in windows):
+                return None
+            tracker = cls(saved_windows, now)
+
+            (string_count,) = struct.unpack_from('<I', body, offset)
+            offset += 4
+            strings = []
+            for _ in range(string_count):
+                (length,) = struct.unpack_from('<H', body, offset)
+                offset += 2
+                strings.append(bytes(body[offset:offset + length]).decode('utf-8', errors='surrogateescape'))
+                offset += length
+
+            (count,) = struct.unpack_from('<I', body, offset)
+            offset += 4
+            watermark_macs = set(struct.unpack_from('<{}Q'.format(count), body, offset))
+            offset += 8 * count
+
+            (bucket_count,) = struct.unpack_from('<I', body, offset)
+            offset += 4
+            for _ in range(bucket_count):
+                bucket, mac_count, ssid_count = struct.unpack_from('<qII', body, offset)
+                offset += 16
+                macs = struct.unpack_from('<{}Q'.format(mac_count), body, offset)
+                offset += 8 * mac_count
+                refs = struct.unpack_from('<{}I'.format(ssid_count), body, offset)
+                offset += 4 * ssid_count
+                spans = struct.unpack_from('<{}d'.format(2 * (mac_count + ssid_count)), body, offset)
+                offset += 16 * (mac_count + ssid_count)
+                if mac_count:
+                    tracker._macs[bucket] = {mac: list(spans[2 * i:2 * i + 2]) for i, mac in enumerate(macs)}
+                if ssid_count:
+                    tracker._ssids[bucket] = {strings[ref]: list(spans[2 * (mac_count + i):2 * (mac_count + i) + 2])
+                                              for i, ref in enumerate(refs)}
+        except (OSError, struct.error, zlib.error, IndexError, ValueError):
+            return None
+        return tracker, watermark_time, watermark_macs
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import json
+import multiprocessing
+import os
 import pathlib
 import glob
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import requests
 import sqlite3
@@ -20,52 +23,102 @@ class ProbeAnalyzer:
         self.probes = {}  # Dictionary to store probe requests {ssid: [timestamps]}
         self.local_only = local_only  # New flag for local search only
         
+    def parse_event_log(self, log_file):
+        """Parse a JSONL CYT event log for probe records"""
+        count = 0
+        with open(log_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('type') != 'probe' or not record.get('ssid'):
+                    continue
+                timestamp = datetime.fromtimestamp(record['ts']).strftime('%Y-%m-%d %H:%M:%S')
+                self.probes.setdefault(record['ssid'], []).append(timestamp)
+                count += 1
+        return count
+        
     def parse_log_file(self, log_file):
-        """Parse a single CYT log file for probe requests"""
+        """Parse a single CYT log file for probe requests, returning how many were found
+        
+        Streams the file a line at a time and carries the last 'Current Time'
+        forward, so each probe gets the nearest timestamp before it without
+        rescanning (or holding) what came before.
+        """
+        if str(log_file).endswith('.jsonl'):
+            return self.parse_event_log(log_file)
+        
         probe_pattern = re.compile(r'Found a probe!: (.*?)\n')
         # Update timestamp pattern to match log format
         timestamp_pattern = re.compile(r'Current Time: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
         
+        timestamp = None
+        count = 0
         with open(log_file, 'r') as f:
-            content = f.read()
-            
-        # Debug: Print all probes found in this file
-        probes_found = probe_pattern.findall(content)
-        print(f"\nFound {len(probes_found)} probes in {log_file}:")
-        for probe in probes_found:
-            print(f"- {probe}")
+            for line in f:
+                probe = probe_pattern.search(line) if 'Found a probe!: ' in line else None
+                if 'Current Time: ' in line:
+                    found = timestamp_pattern.findall(line, 0, probe.start() if probe else len(line))
+                    if found:
+                        timestamp = found[-1]  # Last timestamp before the probe
+                if not probe:
+                    continue
+                ssid = probe.group(1).strip()
+                probe_time = timestamp or self.filename_timestamp(log_file)
+                if probe_time:
+                    self.probes.setdefault(ssid, []).append(probe_time)
+                count += 1
+                # A timestamp after the probe on the same line applies to the next one
+                found = timestamp_pattern.findall(line, probe.start()) if 'Current Time: ' in line else None
+                if found:
+                    timestamp = found[-1]
+        return count
+    
+    @staticmethod
+    def filename_timestamp(log_file):
+        """Timestamp from a log file name, for probes logged before any 'Current Time'
         
-        for probe in probe_pattern.finditer(content):
-            ssid = probe.group(1).strip()
-            # Find nearest timestamp before this probe
-            content_before = content[:probe.start()]
-            timestamp_match = timestamp_pattern.findall(content_before)
-            if timestamp_match:
-                timestamp = timestamp_match[-1]  # Get last timestamp before probe
-                if ssid not in self.probes:
-                    self.probes[ssid] = []
-                self.probes[ssid].append(timestamp)
-            else:
-                # If no timestamp found, use file creation time from filename
-                # Format: cyt_log_MMDDYY_HHMMSS
-                filename = str(log_file)
-                date_str = filename.split('_')[2:4]  # ['MMDDYY', 'HHMMSS']
-                if len(date_str) == 2:
-                    timestamp = f"{date_str[0][:2]}-{date_str[0][2:4]}-{date_str[0][4:]} {date_str[1][:2]}:{date_str[1][2:4]}:{date_str[1][4:]}"
-                    if ssid not in self.probes:
-                        self.probes[ssid] = []
-                    self.probes[ssid].append(timestamp)
+        Format: cyt_log_MMDDYY_HHMMSS
+        """
+        date_str = str(log_file).split('_')[2:4]  # ['MMDDYY', 'HHMMSS']
+        if len(date_str) != 2:
+            return None
+        return f"20{date_str[0][4:]}-{date_str[0][:2]}-{date_str[0][2:4]} {date_str[1][:2]}:{date_str[1][2:4]}:{date_str[1][4:]}"
+    
+    def merge(self, probes):
+        """Add {ssid: [timestamps]} from another parse (e.g. one file's) after what is already here"""
+        for ssid, timestamps in probes.items():
+            self.probes.setdefault(ssid, []).extend(timestamps)
     
-    def parse_all_logs(self):
-        """Parse all log files in the log directory"""
-        log_files = self.log_dir.glob('cyt_log_*')
-        log_count = 0
+    def parse_all_logs(self, processes=None):
+        """Parse all log files in the log directory, one file at a time per worker process
+        
+        Each worker parses a whole file and hands back just its probes, and the
+        results are merged in file name order whichever worker finishes first,
+        so the output is the same for any number of processes.
+        
+        Args:
+            processes: Worker processes (default one per core, 0 or 1 parses in this process)
+        """
+        log_files = sorted(self.log_dir.glob('cyt_log_*'))
+        if processes is None:
+            processes = os.cpu_count() or 1
         print("\nScanning log files:")
-        for log_file in log_files:
-            print(f"- Reading {log_file}")
-            self.parse_log_file(log_file)
-            log_count += 1
-        print(f"\nProcessed {log_count} log files")
+        executor = None
+        if processes > 1 and len(log_files) > 1:
+            executor = ProcessPoolExecutor(min(processes, len(log_files)), mp_context=multiprocessing.get_context('fork'))
+            results = executor.map(_parse_file, log_files)
+        else:
+            results = map(_parse_file, log_files)
+        try:
+            for log_file, (probes, count) in zip(log_files, results):
+                print(f"- {log_file}: {count} probes")
+                self.merge(probes)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        print(f"\nProcessed {len(log_files)} log files")
             
     def query_wigle(self, ssid):
         """Query WiGLE for information about an SSID"""
@@ -117,6 +170,12 @@ class ProbeAnalyzer:
             results.append(result)
         return results
 
+def _parse_file(log_file):
+    """Worker side: ({ssid: [timestamps]}, probe count) of one log file"""
+    analyzer = ProbeAnalyzer(log_dir=log_file.parent)
+    count = analyzer.parse_log_file(log_file)
+    return analyzer.probes, count
+
 def main():
     """
     Probe Request Analyzer for Chasing Your Tail
@@ -147,6 +206,8 @@ def main():
     parser = argparse.ArgumentParser(description='Analyze probe requests and query WiGLE')
     parser.add_argument('--local', action='store_true', 
                       help='Limit WiGLE search to configured bounding box')
+    parser.add_argument('--processes', type=int,
+                      help='Worker processes for parsing logs (default: one per core, 0 for none)')
     args = parser.parse_args()
 
     print("\nAnalyzing probe requests from CYT logs...")
@@ -155,7 +216,7 @@ def main():
         print("WiGLE search limited to configured bounding box")
     else:
         print("WiGLE search will return global results")
-    analyzer.parse_all_logs()
+    analyzer.parse_all_logs(args.processes)
     results = analyzer.analyze_probes()
     
     if not results:
@@ -177,8 +238,8 @@ def main():
         print(f"Last seen: {result['last_seen']}")
         
         # Calculate time span
-        first = datetime.strptime(result['first_seen'], '%m-%d-%y %H:%M:%S')
-        last = datetime.strptime(result['last_seen'], '%m-%d-%y %H:%M:%S')
+        first = datetime.strptime(result['first_seen'], '%Y-%m-%d %H:%M:%S')
+        last = datetime.strptime(result['last_seen'], '%Y-%m-%d %H:%M:%S')
         duration = last - first
         if duration.total_seconds() > 0:
             print(f"Time span: {duration}")
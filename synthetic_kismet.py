@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+### Synthetic Kismet database generator and replay harness for Chasing Your Tail
+### Released under the MIT License https://opensource.org/licenses/MIT
+###
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import random
+import runpy
+import shutil
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+import cyt_clock
+from kismet_db import DEVICES_SCHEMA
+
+### Schema of the Kismet packets table (devices is in kismet_db)
+PACKETS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS packets (
+    ts_sec INT, ts_usec INT, phyname TEXT, sourcemac TEXT, destmac TEXT, transmac TEXT,
+    frequency REAL, devkey TEXT, lat REAL, lon REAL, alt REAL, speed REAL, heading REAL,
+    packet_len INT, signal INT, datasource TEXT, dlt INT, packet BLOB, error INT, tags TEXT,
+    datarate REAL, hash INT, packetid INT)
+"""
+
+### Radiotap header with just the flags field, flagging the FCS at the end of each frame
+RADIOTAP_HEADER = struct.pack('<BBHIB', 0, 0, 9, 0x2, 0x10)
+SUPPORTED_RATES = bytes((1, 8, 0x02, 0x04, 0x0B, 0x16, 0x0C, 0x12, 0x18, 0x24))
+
+DEVICE_TYPES = ['Wi-Fi Client', 'Wi-Fi Client', 'Wi-Fi Client', 'Wi-Fi AP', 'Wi-Fi Device', 'Wi-Fi Bridged']
+
+
+class SyntheticKismet:
+    """Writes a Kismet-like log database driven by a (simulated) clock
+
+    Background devices arrive at random, stay for a random dwell time and leave;
+    followers are present the whole time. Rotating followers are present the
+    whole time too, but pick a new random locally administered MAC every
+    rotate_every minutes while probing for the same SSIDs. Every step() rewrites the devices rows
+    of everyone present (the way Kismet updates last_time) and logs one packet
+    per present device so offline mode has a timeline to replay.
+
+    Args:
+        path: Kismet database to create
+        devices: Size of the background device population
+        followers: Number of devices that stay with the sensor
+        density: Fraction of the background population present at any time
+        dwell: Mean minutes a background device stays in range
+        probe_rate: Fraction of devices that probe for an SSID
+        seed: Random seed, so the same arguments give the same database
+        rotating: Number of followers that randomize their MAC
+        rotate_every: Minutes between MAC changes of a rotating follower
+        capture: Also write every packet as a radiotap probe request to this
+            .pcap or .pcapng file, as tcpdump would have captured it
+    """
+
+    def __init__(self, path, devices=1000, followers=3, density=0.05, dwell=8,
+                 probe_rate=0.4, seed=1, rotating=0, rotate_every=4, capture=None):
+        self.path = path
+        self.rng = random.Random(seed)
+        self.con = sqlite3.connect(path)
+        self.con.execute(DEVICES_SCHEMA)
+        self.con.execute(PACKETS_SCHEMA)
+        self.density = density
+        self.dwell = dwell * 60
+        self.first_seen = {}
+        self.present = {}  # index -> time the device leaves
+        ssids = ['HomeNet-{:04d}'.format(i) for i in range(max(10, devices // 20))]
+        self.devices = [self._make_device(i, ssids, probe_rate) for i in range(devices + followers)]
+        self.followers = list(range(devices, devices + followers))
+        self.background = devices
+        # Separate generator so adding rotating followers leaves everything else as it was
+        rotating_rng = random.Random(seed + 1)
+        self.rotate_every = rotate_every * 60
+        self.rotating = [(rotating_rng.getrandbits(32), rotating_rng.sample(ssids, 2) + ['Follower-{}'.format(i)])
+                         for i in range(rotating)]
+        self.capture = None
+        if capture:
+            self.pcapng = capture.endswith('.pcapng')
+            self.capture = open(capture, 'wb')
+            if self.pcapng:
+                # Section header, then one radiotap interface with nanosecond timestamps
+                self.capture.write(struct.pack('<IIIHHqI', 0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1, 28))
+                self.capture.write(struct.pack('<IIHHIHHB3xHHI', 1, 32, 127, 0, 65535, 9, 1, 9, 0, 0, 32))
+            else:
+                self.capture.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 127))
+
+    def _make_device(self, index, ssids, probe_rate):
+        mac = '{:02X}:{:02X}:{:02X}:{:02X}:{:02X}:{:02X}'.format(
+            0x02 if index % 4 == 0 else 0x00, 0x1A, (index >> 16) & 0xFF,
+            (index >> 8) & 0xFF, index & 0xFF, self.rng.randrange(256))
+        dev_type = self.rng.choice(DEVICE_TYPES)
+        ssid = self.rng.choice(ssids[:len(ssids) // 4] if self.rng.random() < 0.7 else ssids) \
+            if self.rng.random() < probe_rate else ''
+        record = {
+            'kismet.device.base.macaddr': mac,
+            'kismet.device.base.phyname': 'IEEE802.11',
+            'kismet.device.base.type': dev_type,
+            'kismet.device.base.manuf': 'Unknown',
+            'kismet.device.base.channel': str(self.rng.choice([1, 6, 11, 36, 44, 149])),
+            'kismet.device.base.signal': {'kismet.common.signal.last_signal': -self.rng.randrange(30, 95)},
+            'kismet.device.base.packets.rrd': {'kismet.common.rrd.minute_vec': [0] * 60},
+            'dot11.device': {
+                'dot11.device.last_probed_ssid_record': {
+                    'dot11.probedssid.ssid': ssid,
+                    'dot11.probedssid.ssidlen': len(ssid),
+                },
+                'dot11.device.num_probed_ssids': 1 if ssid else 0,
+            },
+        }
+        return mac, dev_type, json.dumps(record).encode()
+
+    def _rotating_device(self, index, now):
+        """MAC and device record of a rotating follower at time now"""
+        ie_fingerprint, probed = self.rotating[index]
+        epoch = (now + index * 97) // self.rotate_every
+        digest = hashlib.blake2b('{}-{}-{}'.format(ie_fingerprint, index, epoch).encode(), digest_size=6).digest()
+        mac = ':'.join('{:02X}'.format(b) for b in (digest[0] & 0xFC | 0x02,) + tuple(digest[1:]))
+        record = {
+            'kismet.device.base.macaddr': mac,
+            'kismet.device.base.phyname': 'IEEE802.11',
+            'kismet.device.base.type': 'Wi-Fi Client',
+            'dot11.device': {
+                'dot11.device.last_probed_ssid_record': {'dot11.probedssid.ssid': probed[epoch % len(probed)]},
+                'dot11.device.probed_ssid_map': [{'dot11.probedssid.ssid': ssid} for ssid in probed],
+                'dot11.device.probe_fingerprint': ie_fingerprint,
+                'dot11.device.num_probed_ssids': len(probed),
+            },
+        }
+        return mac, json.dumps(record).encode()
+
+    def _write_probe(self, now, mac, ssids, vendor):
+        """Probe requests from a MAC for each SSID (a wildcard probe if none), the last one last"""
+        address = bytes.fromhex(mac.replace(':', ''))
+        for ssid in ssids or ['']:
+            ssid = ssid.encode()
+            frame = (b'\x40\x00\x00\x00' + b'\xff' * 6 + address + b'\xff' * 6 + b'\x00\x00'
+                     + bytes((0, len(ssid))) + ssid + SUPPORTED_RATES + bytes((221, len(vendor))) + vendor)
+            packet = RADIOTAP_HEADER + frame + struct.pack('<I', zlib.crc32(frame))
+            if self.pcapng:
+                padded = packet + b'\x00' * (-len(packet) % 4)
+                ts = now * 1000000000
+                self.capture.write(struct.pack('<IIIIIII', 6, 32 + len(padded), 0, ts >> 32, ts & 0xFFFFFFFF,
+                                               len(packet), len(packet)) + padded + struct.pack('<I', 32 + len(padded)))
+            else:
+                self.capture.write(struct.pack('<IIII', now, 0, len(packet), len(packet)) + packet)
+
+    def step(self, now):
+        """Advance the population to now and write everyone present"""
+        now = int(now)
+        for index in [i for i, leave in self.present.items() if leave <= now]:
+            del self.present[index]
+        target = int(self.background * self.density)
+        while len(self.present) < target:
+            index = self.rng.randrange(self.background)
+            if index not in self.present:
+                self.present[index] = now + int(self.rng.expovariate(1 / self.dwell)) + 60
+        rows = []
+        packets = []
+        for index in list(self.present) + self.followers:
+            mac, dev_type, blob = self.devices[index]
+            first = self.first_seen.setdefault(index, now)
+            rows.append((first, now, '4202770D00000000_{}'.format(index), 'IEEE802.11', mac,
+                         -60, dev_type, blob))
+            packets.append((now, mac))
+            if self.capture:
+                # Vendor IE unique to the device, so background devices never share a fingerprint
+                ssid = json.loads(blob)['dot11.device']['dot11.device.last_probed_ssid_record']['dot11.probedssid.ssid']
+                self._write_probe(now, mac, [ssid] if ssid else [], b'\x00\x50\xf2' + index.to_bytes(4, 'big'))
+        for index in range(len(self.rotating)):
+            mac, blob = self._rotating_device(index, now)
+            if self.capture:
+                ie_fingerprint, probed = self.rotating[index]
+                last = json.loads(blob)['dot11.device']['dot11.device.last_probed_ssid_record']['dot11.probedssid.ssid']
+                self._write_probe(now, mac, [ssid for ssid in probed if ssid != last] + [last],
+                                  b'\x00\x10\x18' + ie_fingerprint.to_bytes(4, 'big'))
+            first = self.first_seen.setdefault(mac, now)
+            rows.append((first, now, '4202770D00000000_{}'.format(mac), 'IEEE802.11', mac,
+                         -55, 'Wi-Fi Client', blob))
+            packets.append((now, mac))
+        self.con.executemany(
+            "INSERT OR REPLACE INTO devices VALUES (?,?,?,?,?,?,0,0,0,0,0,0,0,?,?)", rows)
+        self.con.executemany(
+            "INSERT INTO packets (ts_sec, ts_usec, phyname, sourcemac) VALUES (?, 0, 'IEEE802.11', ?)", packets)
+        self.con.commit()
+        if self.capture:
+            self.capture.flush()
+        return len(rows)
+
+    def close(self):
+        self.con.close()
+        if self.capture:
+            self.capture.close()
+
+
+def alert_digest(log_dir, start):
+    """(count, sha256) of every alert in the JSONL logs of a directory
+
+    Times are taken relative to the replay start and the alerts are sorted, so
+    the digest only changes when detection results change.
+    """
+    alerts = []
+    for log_file in pathlib.Path(log_dir).glob('cyt_log_*.jsonl'):
+        with open(log_file) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('type') == 'alert':
+                    alerts.append('{} {} {} {}'.format(int(record['ts'] - start), record['level'], record['mac'], record['window']))
+    alerts.sort()
+    return len(alerts), hashlib.sha256('\n'.join(alerts).encode()).hexdigest()
+
+
+def _run_dir(args):
+    """Fresh output directory with a config.json pointing CYT at it, and the CYT script"""
+    out_dir = pathlib.Path(args.out).resolve()
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+    script = pathlib.Path(__file__).resolve().parent / 'chasing_your_tail.py'
+
+    with open(script.parent / 'config.json') as f:
+        config = json.load(f)
+    config['paths']['kismet_logs'] = str(out_dir / '*.kismet')
+    config['paths']['log_dir'] = str(out_dir / 'logs')
+    config['paths']['checkpoint'] = 'replay_state.ckpt'
+    config.setdefault('database', {})['snapshot_dir'] = ''
+    if args.rotating:
+        config.setdefault('linking', {})['enabled'] = True  # Rotating followers are only caught by linking
+    with open(out_dir / 'config.json', 'w') as f:
+        json.dump(config, f, indent=4)
+    return out_dir, script
+
+
+def _run_cyt(script, out_dir, argv, quiet):
+    """Run chasing_your_tail.py in out_dir with argv, returning the seconds it took"""
+    os.chdir(out_dir)
+    sys.argv = [str(script)] + argv
+    sys.path.insert(0, str(script.parent))
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        try:
+            runpy.run_path(str(script), run_name='__main__')
+        except SystemExit:
+            pass  # --offline exits when done
+    return time.perf_counter() - started
+
+
+def offline(args):
+    """Write a whole synthetic session (and its capture, with --capture) and run CYT --offline over both
+
+    With a capture the same devices come from two overlapping sources, which
+    is how a real capture directory looks.
+    """
+    out_dir, script = _run_dir(args)
+    start = int(time.time()) - int(args.hours * 3600)
+    start -= start % 3600
+    capture = str(out_dir / 'synthetic.{}'.format(args.capture)) if args.capture else None
+    generator = SyntheticKismet(str(out_dir / 'synthetic.kismet'), args.devices, args.followers,
+                                args.density, args.dwell, seed=args.seed, rotating=args.rotating, capture=capture)
+    for now in range(start, start + int(args.hours * 3600) + 1, args.interval):
+        generator.step(now)
+    generator.close()
+
+    elapsed = _run_cyt(script, out_dir, ['--offline', str(out_dir)], args.quiet)
+    count, digest = alert_digest(out_dir / 'logs', start)
+    print('Analyzed {:.1f} h of {} devices ({} followers, {} rotating{}) offline in {:.1f}s'.format(
+        args.hours, args.devices, args.followers, args.rotating, ', plus a capture' if capture else '', elapsed))
+    print('{} alerts, digest {}'.format(count, digest))
+
+
+def replay(args):
+    """Run the live chasing_your_tail.py loop against a synthetic database on a simulated clock"""
+    out_dir, script = _run_dir(args)
+
+    # Align to the hour so time buckets (and so the alert digest) repeat between runs
+    start = int(time.time()) - int(args.hours * 3600)
+    start -= start % 3600
+    capture = str(out_dir / 'synthetic.{}'.format(args.capture)) if args.capture else None
+    generator = SyntheticKismet(str(out_dir / 'synthetic.kismet'), args.devices, args.followers,
+                                args.density, args.dwell, seed=args.seed, rotating=args.rotating, capture=capture)
+    generator.step(start)
+    cycles = []
+
+    def on_sleep(now):
+        cycles.append(time.perf_counter())
+        generator.step(now)
+
+    cyt_clock.set_clock(cyt_clock.SimulatedClock(start, until=start + args.hours * 3600, on_sleep=on_sleep))
+    argv = ['--pcap', capture] if capture else []
+    if args.learn:
+        argv += ['--learn', str(args.learn)]
+    elapsed = _run_cyt(script, out_dir, argv, args.quiet)
+    generator.close()
+
+    count, digest = alert_digest(out_dir / 'logs', start)
+    print('Replayed {:.1f} h of {} devices ({} followers, {} rotating) in {:.1f}s: {} cycles, {:.1f} cycles/s'.format(
+        args.hours, args.devices, args.followers, args.rotating, elapsed, len(cycles), len(cycles) / elapsed if elapsed else 0))
+    print('{} alerts, digest {}'.format(count, digest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Kismet logs and replay them through Chasing Your Tail')
+    parser.add_argument('out', help='Kismet file to write (or output directory with --replay)')
+    parser.add_argument('--devices', type=int, default=1000, help='Background device population')
+    parser.add_argument('--followers', type=int, default=3, help='Devices that stay with the sensor')
+    parser.add_argument('--density', type=float, default=0.05, help='Fraction of devices present at once')
+    parser.add_argument('--dwell', type=float, default=8, help='Mean minutes a device stays in range')
+    parser.add_argument('--hours', type=float, default=1, help='Simulated duration')
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between Kismet updates when generating')
+    parser.add_argument('--rotating', type=int, default=0, help='Followers that randomize their MAC every few minutes')
+    parser.add_argument('--capture', choices=['pcap', 'pcapng'],
+                        help='Also write the packets as a probe request capture (next to the Kismet file); '
+                             'with --replay, CYT reads the capture instead of the Kismet log')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replay', action='store_true',
+                        help='Run the live detection loop against the generated data on a simulated clock')
+    parser.add_argument('--offline', action='store_true',
+                        help='Write the whole session (and --capture) to the output directory and run CYT --offline on it')
+    parser.add_argument('--quiet', action='store_true', help='Hide CYT console output during --replay/--offline')
+    parser.add_argument('--learn', type=float, metavar='MINUTES',
+                        help='With --replay, start CYT in learning mode for the first MINUTES')
+    args = parser.parse_args()
+
+    if args.replay:
+        replay(args)
+        return
+    if args.offline:
+        offline(args)
+        return
+
+    start = int(time.time()) - int(args.hours * 3600)
+    capture = os.path.splitext(args.out)[0] + '.' + args.capture if args.capture else None
+    generator = SyntheticKismet(args.out, args.devices, args.followers, args.density, args.dwell, seed=args.seed,
+                                rotating=args.rotating, capture=capture)
+    for now in range(start, start + int(args.hours * 3600) + 1, args.interval):
+        generator.step(now)
+    generator.close()
+    print('Wrote {} ({:.1f} h, {} devices, {} followers)'.format(args.out, args.hours, args.devices, args.followers))
+
+
+if __name__ == '__main__':
+    main()